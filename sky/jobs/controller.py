@@ -1214,4 +1214,10 @@ async def main(controller_uuid: str):
 
 
 if __name__ == '__main__':
+    # Checkpoint the jobs DB WAL in the background rather than on whichever
+    # state transition happens to cross the autocheckpoint threshold, and keep
+    # the query planner statistics up to date. Started before the event loop,
+    # as the first call initializes the DB, which would block the loop, and so
+    # that no async connection is opened with autocheckpointing enabled.
+    managed_job_state.start_db_maintenance_thread()
     asyncio.run(main(sys.argv[1]))
@@ -176,12 +176,12 @@ def _maybe_submit_job_locally(prefix: str, dag: 'sky.Dag',
                 pool=pool,
                 pool_hash=pool_hash,
                 user_hash=common_utils.get_user_hash()))
-        for task_id, task in enumerate(dag.tasks):
-            resources_str = backend_utils.get_task_resources_str(
-                task, is_managed_job=True)
-            managed_job_state.set_pending(consolidation_mode_job_id, task_id,
-                                          task.name, resources_str,
-                                          task.metadata_json)
+        managed_job_state.set_pending_many(
+            consolidation_mode_job_id,
+            [(task_id, task.name,
+              backend_utils.get_task_resources_str(
+                  task, is_managed_job=True), task.metadata_json)
+             for task_id, task in enumerate(dag.tasks)])
         job_ids.append(consolidation_mode_job_id)
     return job_ids
 
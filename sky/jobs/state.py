@@ -2,7 +2,9 @@
 # TODO(zhwu): maybe use file based status instead of database, so
 # that we can easily switch to a s3-based storage.
 import asyncio
+import atexit
 import collections
+import contextlib
 import enum
 import functools
 import ipaddress
@@ -11,8 +13,10 @@ import sqlite3
 import threading
 import time
 import typing
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, Iterable,
+                    List, Optional, Tuple, Union)
 import urllib.parse
+import weakref
 
 import colorama
 import sqlalchemy
@@ -30,6 +34,7 @@ from sky.adaptors import common as adaptors_common
 from sky.skylet import constants
 from sky.utils import common_utils
 from sky.utils import context_utils
+from sky.utils import subprocess_utils
 from sky.utils.db import db_utils
 from sky.utils.db import migration_utils
 
@@ -53,6 +58,12 @@ _SQLALCHEMY_ENGINE_ASYNC: Optional[sql_async.AsyncEngine] = None
 _SQLALCHEMY_ENGINE_LOCK = threading.Lock()
 
 _DB_RETRY_TIMES = 30
+_DB_RETRYABLE_EXCEPTIONS = (sqlalchemy_exc.OperationalError,
+                            asyncio.exceptions.TimeoutError, OSError,
+                            sqlalchemy_exc.TimeoutError,
+                            sqlite3.OperationalError,
+                            sqlalchemy_exc.InterfaceError,
+                            sqlite3.InterfaceError)
 
 Base = declarative.declarative_base()
 
@@ -88,7 +99,7 @@ spot_table = sqlalchemy.Table(
     sqlalchemy.Column('recovery_count', sqlalchemy.Integer, server_default='0'),
     sqlalchemy.Column('job_duration', sqlalchemy.Float, server_default='0'),
     sqlalchemy.Column('failure_reason', sqlalchemy.Text),
-    sqlalchemy.Column('spot_job_id', sqlalchemy.Integer, index=True),
+    sqlalchemy.Column('spot_job_id', sqlalchemy.Integer),
     sqlalchemy.Column('task_id', sqlalchemy.Integer, server_default='0'),
     sqlalchemy.Column('task_name', sqlalchemy.Text),
     sqlalchemy.Column('specs', sqlalchemy.Text),
@@ -97,6 +108,13 @@ spot_table = sqlalchemy.Table(
     sqlalchemy.Column('logs_cleaned_at', sqlalchemy.Float, server_default=None),
 )
 
+# Serves the per-task lookups, including the status transitions, as well as
+# the job's tasks ordered by task_id and the lookups by spot_job_id alone. A
+# task has a single row, so the status and end_at conditions of a transition
+# are checked on that row and need no index of their own.
+sqlalchemy.Index('idx_spot_job_task', spot_table.c.spot_job_id,
+                 spot_table.c.task_id)
+
 job_info_table = sqlalchemy.Table(
     'job_info',
     Base.metadata,
@@ -143,6 +161,14 @@ job_info_table = sqlalchemy.Table(
                       server_default=None),
 )
 
+# Serves the scheduler's sweeps over job_info by schedule state. It also covers
+# picking the highest priority waiting job (see _HIGHEST_PRIORITY_FIRST), so
+# that lookup is a single index range scan, without a sort or a read of the
+# table row.
+sqlalchemy.Index('idx_job_info_waiting', job_info_table.c.schedule_state,
+                 job_info_table.c.priority.desc(), job_info_table.c.spot_job_id,
+                 job_info_table.c.pool)
+
 # TODO(cooperc): drop the table in a migration
 ha_recovery_script_table = sqlalchemy.Table(
     'ha_recovery_script',
@@ -151,8 +177,64 @@ ha_recovery_script_table = sqlalchemy.Table(
     sqlalchemy.Column('script', sqlalchemy.Text),
 )
 
+# Per-connection SQLite pragmas. Unlike journal_mode=WAL, which is persisted in
+# the database file, these only apply to the connection that sets them, so they
+# are applied on every new DBAPI connection of the engine.
+# - synchronous=NORMAL: in WAL mode, only fsync on checkpoints, not on every
+#   commit. A power loss may roll back the last transactions, but the database
+#   cannot be corrupted.
+# - busy_timeout (see _SQLITE_MIN_BUSY_TIMEOUT_MS): wait for the write lock
+#   instead of failing immediately with "database is locked" when multiple
+#   controllers write concurrently.
+# - temp_store, mmap_size, cache_size: keep temp tables, indexes and hot pages
+#   in memory (256MB mmap, ~20MB page cache).
+# - analysis_limit: bound the work of the ANALYZE run by PRAGMA optimize, as
+#   recommended by the SQLite docs for long-lived connections.
+_SQLITE_CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA analysis_limit=1000',
+)
+# Checkpoint the WAL every 1000 pages (the SQLite default, set explicitly so it
+# is not affected by compile-time options), unless this process runs the
+# background maintenance thread, see start_db_maintenance_thread.
+_SQLITE_WAL_AUTOCHECKPOINT_PAGES = 1000
+# Only raised to this, never lowered: the async engine already gets a longer
+# lock timeout from its connect_args in db_utils.get_engine.
+_SQLITE_MIN_BUSY_TIMEOUT_MS = 10000
+_WAL_CHECKPOINT_INTERVAL_SECONDS = 10
+_OPTIMIZE_INTERVAL_SECONDS = 3 * 60 * 60
+_DB_MAINTENANCE_THREAD: Optional[threading.Thread] = None
+
+
+def _set_sqlite_connection_pragmas(dbapi_connection, connection_record):
+    del connection_record  # Unused.
+    autocheckpoint_pages = (0 if _DB_MAINTENANCE_THREAD is not None else
+                            _SQLITE_WAL_AUTOCHECKPOINT_PAGES)
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in _SQLITE_CONNECTION_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.execute('PRAGMA busy_timeout')
+        if cursor.fetchone()[0] < _SQLITE_MIN_BUSY_TIMEOUT_MS:
+            cursor.execute(f'PRAGMA busy_timeout={_SQLITE_MIN_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA wal_autocheckpoint={autocheckpoint_pages}')
+    finally:
+        cursor.close()
+
+
+def _listen_sqlite_connection_pragmas(engine: sqlalchemy.engine.Engine):
+    if (engine.dialect.name == db_utils.SQLAlchemyDialect.SQLITE.value and
+            not sqlalchemy.event.contains(engine, 'connect',
+                                          _set_sqlite_connection_pragmas)):
+        sqlalchemy.event.listen(engine, 'connect',
+                                _set_sqlite_connection_pragmas)
+
 
 def create_table(engine: sqlalchemy.engine.Engine):
+    _listen_sqlite_connection_pragmas(engine)
     # Enable WAL mode to avoid locking issues.
     # See: issue #3863, #1441 and PR #1509
     # https://github.com/microsoft/WSL/issues/2395
@@ -163,7 +245,6 @@ def create_table(engine: sqlalchemy.engine.Engine):
         try:
             with orm.Session(engine) as session:
                 session.execute(sqlalchemy.text('PRAGMA journal_mode=WAL'))
-                session.execute(sqlalchemy.text('PRAGMA synchronous=1'))
                 session.commit()
         except sqlalchemy_exc.OperationalError as e:
             if 'database is locked' not in str(e):
@@ -205,8 +286,11 @@ def initialize_and_get_db_async() -> sql_async.AsyncEngine:
         if _SQLALCHEMY_ENGINE_ASYNC is not None:
             return _SQLALCHEMY_ENGINE_ASYNC
 
-        _SQLALCHEMY_ENGINE_ASYNC = db_utils.get_engine('spot_jobs',
-                                                       async_engine=True)
+        engine = db_utils.get_engine('spot_jobs', async_engine=True)
+        # The async engine opens its own aiosqlite connections, which need the
+        # same per-connection pragmas as the sync ones.
+        _listen_sqlite_connection_pragmas(engine.sync_engine)
+        _SQLALCHEMY_ENGINE_ASYNC = engine
 
     # to create the table in case an async function gets called first
     initialize_and_get_db()
@@ -238,6 +322,70 @@ def initialize_and_get_db() -> sqlalchemy.engine.Engine:
         return _SQLALCHEMY_ENGINE
 
 
+def _optimize_sqlite_db(engine: sqlalchemy.engine.Engine):
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA optimize')
+    except sqlalchemy_exc.OperationalError as e:
+        logger.debug(f'Failed to optimize the jobs DB: {e}')
+
+
+def _db_maintenance_loop(engine: sqlalchemy.engine.Engine):
+    last_optimize = time.monotonic()
+    while True:
+        time.sleep(_WAL_CHECKPOINT_INTERVAL_SECONDS)
+        # Keep the thread alive on any error: autocheckpointing is disabled on
+        # this process's connections, so if the thread exits, nothing
+        # checkpoints the WAL anymore and it grows without bound.
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(PASSIVE)')
+        except sqlalchemy_exc.OperationalError as e:
+            logger.debug(f'Failed to checkpoint the jobs DB WAL: {e}')
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f'Failed to checkpoint the jobs DB WAL: {e}')
+        if time.monotonic() - last_optimize >= _OPTIMIZE_INTERVAL_SECONDS:
+            try:
+                _optimize_sqlite_db(engine)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f'Failed to optimize the jobs DB: {e}')
+            last_optimize = time.monotonic()
+
+
+def start_db_maintenance_thread():
+    """Run SQLite maintenance for the jobs DB from a background thread.
+
+    By default, the commit that grows the WAL past the autocheckpoint
+    threshold runs the checkpoint itself, which shows up as an occasional slow
+    state transition. Long-lived processes such as the jobs controller can call
+    this to disable autocheckpointing on their connections, both sync and
+    async, and run a PASSIVE checkpoint periodically in a daemon thread
+    instead. Call it before opening any async connection, and outside of the
+    event loop: it initializes the DB, and only the sync engine's pooled
+    connections are reopened with the new setting.
+
+    The thread also runs PRAGMA optimize every few hours, and once more when
+    the process exits, so that the query planner statistics follow the
+    growing tables. This is a no-op for postgres and if the thread is already
+    running.
+    """
+    global _DB_MAINTENANCE_THREAD
+    engine = initialize_and_get_db()
+    if engine.dialect.name != db_utils.SQLAlchemyDialect.SQLITE.value:
+        return
+    with _SQLALCHEMY_ENGINE_LOCK:
+        if _DB_MAINTENANCE_THREAD is not None:
+            return
+        _DB_MAINTENANCE_THREAD = threading.Thread(target=_db_maintenance_loop,
+                                                  args=(engine,),
+                                                  daemon=True)
+        _DB_MAINTENANCE_THREAD.start()
+        atexit.register(_optimize_sqlite_db, engine)
+    # Pooled connections were opened with autocheckpoint enabled. Drop them so
+    # that new connections pick up the setting.
+    engine.dispose()
+
+
 def _init_db_async(func):
     """Initialize the async database. Add backoff to the function call."""
 
@@ -249,19 +397,20 @@ def _init_db_async(func):
             # common case.
             await context_utils.to_thread(initialize_and_get_db_async)
 
+        # Fast path: the first attempt almost always succeeds, so only set
+        # up the backoff once it fails.
+        try:
+            return await func(*args, **kwargs)
+        except _DB_RETRYABLE_EXCEPTIONS as e:
+            last_exc = e
         backoff = common_utils.Backoff(initial_backoff=1, max_backoff_factor=5)
-        last_exc = None
-        for _ in range(_DB_RETRY_TIMES):
+        for _ in range(_DB_RETRY_TIMES - 1):
+            logger.debug(f'DB error: {last_exc}')
+            await asyncio.sleep(backoff.current_backoff())
             try:
                 return await func(*args, **kwargs)
-            except (sqlalchemy_exc.OperationalError,
-                    asyncio.exceptions.TimeoutError, OSError,
-                    sqlalchemy_exc.TimeoutError, sqlite3.OperationalError,
-                    sqlalchemy_exc.InterfaceError, sqlite3.InterfaceError) as e:
+            except _DB_RETRYABLE_EXCEPTIONS as e:
                 last_exc = e
-            logger.debug(f'DB error: {last_exc}')
-            await asyncio.sleep(backoff.current_backoff())
-        assert last_exc is not None
         raise last_exc
 
     return wrapper
@@ -278,24 +427,68 @@ def _init_db(func):
             # common case.
             initialize_and_get_db()
 
+        # Fast path: the first attempt almost always succeeds, so only set
+        # up the backoff once it fails.
+        try:
+            return func(*args, **kwargs)
+        except _DB_RETRYABLE_EXCEPTIONS as e:
+            last_exc = e
         backoff = common_utils.Backoff(initial_backoff=1, max_backoff_factor=10)
-        last_exc = None
-        for _ in range(_DB_RETRY_TIMES):
+        for _ in range(_DB_RETRY_TIMES - 1):
+            logger.debug(f'DB error: {last_exc}')
+            time.sleep(backoff.current_backoff())
             try:
                 return func(*args, **kwargs)
-            except (sqlalchemy_exc.OperationalError,
-                    asyncio.exceptions.TimeoutError, OSError,
-                    sqlalchemy_exc.TimeoutError, sqlite3.OperationalError,
-                    sqlalchemy_exc.InterfaceError, sqlite3.InterfaceError) as e:
+            except _DB_RETRYABLE_EXCEPTIONS as e:
                 last_exc = e
-            logger.debug(f'DB error: {last_exc}')
-            time.sleep(backoff.current_backoff())
-        assert last_exc is not None
         raise last_exc
 
     return wrapper
 
 
+# One lock per event loop, since an asyncio.Lock can only be used from the loop
+# it was first used on.
+_ASYNC_SQLITE_WRITE_LOCKS: 'weakref.WeakKeyDictionary' = (
+    weakref.WeakKeyDictionary())
+
+
+@contextlib.asynccontextmanager
+async def _async_write_session(
+        immediate: bool = False) -> AsyncIterator[sql_async.AsyncSession]:
+    """Open an async session for a write transaction.
+
+    SQLite only allows one writer at a time. Without coordination, concurrent
+    writers from the same controller wait on the file lock in SQLite's busy
+    handler, which polls with growing sleeps, and a transaction that reads
+    before it writes can fail with "database is locked" straight away. On
+    SQLite, queue the writers of this process on an asyncio.Lock instead, so
+    that at most one of them holds the database write lock.
+
+    Args:
+        immediate: On SQLite, start the transaction with BEGIN IMMEDIATE, so
+            that it takes the write lock up front, waiting for writers in other
+            processes within the busy timeout. Use this for transactions that
+            read before they write, which otherwise fail with "database is
+            locked" if another process writes between the read and the write.
+            Transactions that start with a write do not need this.
+    """
+    assert _SQLALCHEMY_ENGINE_ASYNC is not None
+    if (_SQLALCHEMY_ENGINE_ASYNC.dialect.name !=
+            db_utils.SQLAlchemyDialect.SQLITE.value):
+        async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+            yield session
+        return
+    loop = asyncio.get_running_loop()
+    lock = _ASYNC_SQLITE_WRITE_LOCKS.get(loop)
+    if lock is None:
+        lock = _ASYNC_SQLITE_WRITE_LOCKS[loop] = asyncio.Lock()
+    async with lock:
+        async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+            if immediate:
+                await session.execute(sqlalchemy.text('BEGIN IMMEDIATE'))
+            yield session
+
+
 async def _describe_task_transition_failure(session: sql_async.AsyncSession,
                                             job_id: int, task_id: int) -> str:
     """Return a human-readable description when a task transition fails."""
@@ -328,55 +521,82 @@ async def _describe_task_transition_failure(session: sql_async.AsyncSession,
 # Column names to be used in the jobs dict returned to the caller,
 # e.g., via sky jobs queue. These may not correspond to actual
 # column names in the DB and it corresponds to the combined view
-# by joining the spot and job_info tables.
-def _get_jobs_dict(r: 'row.RowMapping') -> Dict[str, Any]:
-    # WARNING: If you update these you may also need to update GetJobTable in
-    # the skylet ManagedJobsServiceImpl.
-    return {
-        '_job_id': r.get('job_id'),  # from spot table
-        '_task_name': r.get('job_name'),  # deprecated, from spot table
-        'resources': r.get('resources'),
-        'submitted_at': r.get('submitted_at'),
-        'status': r.get('status'),
-        'run_timestamp': r.get('run_timestamp'),
-        'start_at': r.get('start_at'),
-        'end_at': r.get('end_at'),
-        'last_recovered_at': r.get('last_recovered_at'),
-        'recovery_count': r.get('recovery_count'),
-        'job_duration': r.get('job_duration'),
-        'failure_reason': r.get('failure_reason'),
-        'job_id': r.get(spot_table.c.spot_job_id
-                       ),  # ambiguous, use table.column
-        'task_id': r.get('task_id'),
-        'task_name': r.get('task_name'),
-        'specs': r.get('specs'),
-        'local_log_file': r.get('local_log_file'),
-        'metadata': r.get('metadata'),
-        # columns from job_info table (some may be None for legacy jobs)
-        '_job_info_job_id': r.get(job_info_table.c.spot_job_id
-                                 ),  # ambiguous, use table.column
-        'job_name': r.get('name'),  # from job_info table
-        'schedule_state': r.get('schedule_state'),
-        'controller_pid': r.get('controller_pid'),
-        'controller_pid_started_at': r.get('controller_pid_started_at'),
-        # the _path columns are for backwards compatibility, use the _content
-        # columns instead
-        'dag_yaml_path': r.get('dag_yaml_path'),
-        'env_file_path': r.get('env_file_path'),
-        'dag_yaml_content': r.get('dag_yaml_content'),
-        'env_file_content': r.get('env_file_content'),
-        'config_file_content': r.get('config_file_content'),
-        'user_hash': r.get('user_hash'),
-        'workspace': r.get('workspace'),
-        'priority': r.get('priority'),
-        'entrypoint': r.get('entrypoint'),
-        'original_user_yaml_path': r.get('original_user_yaml_path'),
-        'original_user_yaml_content': r.get('original_user_yaml_content'),
-        'pool': r.get('pool'),
-        'current_cluster_name': r.get('current_cluster_name'),
-        'job_id_on_pool_cluster': r.get('job_id_on_pool_cluster'),
-        'pool_hash': r.get('pool_hash'),
+# by joining the spot and job_info tables. Each entry is a pair of
+# (jobs dict key, result row key).
+# WARNING: If you update these you may also need to update GetJobTable in
+# the skylet ManagedJobsServiceImpl.
+_JOBS_DICT_COLUMNS: List[Tuple[str, Any]] = [
+    ('_job_id', 'job_id'),  # from spot table
+    ('_task_name', 'job_name'),  # deprecated, from spot table
+    ('resources', 'resources'),
+    ('submitted_at', 'submitted_at'),
+    ('status', 'status'),
+    ('run_timestamp', 'run_timestamp'),
+    ('start_at', 'start_at'),
+    ('end_at', 'end_at'),
+    ('last_recovered_at', 'last_recovered_at'),
+    ('recovery_count', 'recovery_count'),
+    ('job_duration', 'job_duration'),
+    ('failure_reason', 'failure_reason'),
+    # ambiguous, use table.column
+    ('job_id', spot_table.c.spot_job_id),
+    ('task_id', 'task_id'),
+    ('task_name', 'task_name'),
+    ('specs', 'specs'),
+    ('local_log_file', 'local_log_file'),
+    ('metadata', 'metadata'),
+    # columns from job_info table (some may be None for legacy jobs)
+    # ambiguous, use table.column
+    ('_job_info_job_id', job_info_table.c.spot_job_id),
+    ('job_name', 'name'),  # from job_info table
+    ('schedule_state', 'schedule_state'),
+    ('controller_pid', 'controller_pid'),
+    ('controller_pid_started_at', 'controller_pid_started_at'),
+    # the _path columns are for backwards compatibility, use the _content
+    # columns instead
+    ('dag_yaml_path', 'dag_yaml_path'),
+    ('env_file_path', 'env_file_path'),
+    ('dag_yaml_content', 'dag_yaml_content'),
+    ('env_file_content', 'env_file_content'),
+    ('config_file_content', 'config_file_content'),
+    ('user_hash', 'user_hash'),
+    ('workspace', 'workspace'),
+    ('priority', 'priority'),
+    ('entrypoint', 'entrypoint'),
+    ('original_user_yaml_path', 'original_user_yaml_path'),
+    ('original_user_yaml_content', 'original_user_yaml_content'),
+    ('pool', 'pool'),
+    ('current_cluster_name', 'current_cluster_name'),
+    ('job_id_on_pool_cluster', 'job_id_on_pool_cluster'),
+    ('pool_hash', 'pool_hash'),
+]
+
+
+def _get_jobs_dicts(rows: List['row.Row'],
+                    columns: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Convert joined spot and job_info rows to jobs dicts.
+
+    Args:
+        rows: The result rows.
+        columns: The selected columns of the query that returned the rows.
+
+    Which of the columns are present only depends on the query, so each of
+    them is resolved to its position in the rows once. Indexing the rows by
+    position is much cheaper than looking up keys on their mappings.
+    """
+    positions_by_column: Dict[Any, int] = {}
+    positions_by_name: Dict[str, int] = {}
+    for i, column in enumerate(columns):
+        positions_by_column.setdefault(column, i)
+        positions_by_name.setdefault(column.name, i)
+    positions = [(name, positions_by_name.get(key)
+                  if isinstance(key, str) else positions_by_column.get(key))
+                 for name, key in _JOBS_DICT_COLUMNS]
+    return [{
+        name: r[position] if position is not None else None
+        for name, position in positions
     }
+            for r in rows]
 
 
 class ManagedJobStatus(enum.Enum):
@@ -460,18 +680,16 @@ class ManagedJobStatus(enum.Enum):
     FAILED_CONTROLLER = 'FAILED_CONTROLLER'
 
     def is_terminal(self) -> bool:
-        return self in self.terminal_statuses()
+        return self in _TERMINAL_SPOT_STATUSES
 
     def is_failed(self) -> bool:
-        return self in self.failure_statuses()
+        return self in _FAILURE_SPOT_STATUSES
 
     def colored_str(self) -> str:
-        color = _SPOT_STATUS_TO_COLOR[self]
-        return f'{color}{self.value}{colorama.Style.RESET_ALL}'
+        return _SPOT_STATUS_TO_COLORED_STR[self]
 
     def __lt__(self, other) -> bool:
-        status_list = list(ManagedJobStatus)
-        return status_list.index(self) < status_list.index(other)
+        return _SPOT_STATUS_ORDER[self] < _SPOT_STATUS_ORDER[other]
 
     @classmethod
     def terminal_statuses(cls) -> List['ManagedJobStatus']:
@@ -572,6 +790,18 @@ class ManagedJobStatus(enum.Enum):
         return enum_to_protobuf[self]
 
 
+# Position of each status in the definition order, used by
+# ManagedJobStatus.__lt__.
+_SPOT_STATUS_ORDER = {status: i for i, status in enumerate(ManagedJobStatus)}
+
+# Set versions of the status groups, for the is_terminal and is_failed
+# membership checks.
+_TERMINAL_SPOT_STATUSES = frozenset(ManagedJobStatus.terminal_statuses())
+_FAILURE_SPOT_STATUSES = frozenset(ManagedJobStatus.failure_statuses())
+# The values of the terminal statuses, for the queries that filter on them.
+_TERMINAL_SPOT_STATUS_VALUES = tuple(
+    status.value for status in ManagedJobStatus.terminal_statuses())
+
 _SPOT_STATUS_TO_COLOR = {
     ManagedJobStatus.PENDING: colorama.Fore.BLUE,
     ManagedJobStatus.STARTING: colorama.Fore.BLUE,
@@ -589,6 +819,11 @@ _SPOT_STATUS_TO_COLOR = {
     ManagedJobStatus.DEPRECATED_SUBMITTED: colorama.Fore.BLUE,
 }
 
+_SPOT_STATUS_TO_COLORED_STR = {
+    status: f'{color}{status.value}{colorama.Style.RESET_ALL}'
+    for status, color in _SPOT_STATUS_TO_COLOR.items()
+}
+
 
 class ManagedJobScheduleState(enum.Enum):
     """Captures the state of the job from the scheduler's perspective.
@@ -715,6 +950,30 @@ ControllerPidRecord = collections.namedtuple('ControllerPidRecord', [
 ])
 
 
+# The queries on the controllers' and the scheduler's hot paths are prebuilt
+# once, as module-level statements with bind parameters, right above the
+# function that runs them. A call then only binds the new values, and always
+# hits SQLAlchemy's compiled cache and the DB driver's prepared statement cache.
+def _task_transition_condition(status_condition):
+    return sqlalchemy.and_(
+        spot_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'),
+        spot_table.c.task_id == sqlalchemy.bindparam('b_task_id'),
+        status_condition,
+        spot_table.c.end_at.is_(None),
+    )
+
+
+def _task_status_in(statuses: List[ManagedJobStatus]):
+    """Condition on the task status being one of a fixed set of statuses.
+
+    Unlike in_() on a list of plain values, which uses an expanding parameter
+    that SQLAlchemy renders into the SQL again on every execution, this
+    compiles to a fixed 'status IN (?, ?, ...)'.
+    """
+    return spot_table.c.status.in_(
+        [sqlalchemy.literal(status.value) for status in statuses])
+
+
 # === Status transition functions ===
 @_init_db
 def set_job_info_without_job_id(name: str, workspace: str, entrypoint: str,
@@ -758,6 +1017,34 @@ def set_job_info_without_job_id(name: str, workspace: str, entrypoint: str,
             raise ValueError('Unsupported database dialect')
 
 
+# Insert a PENDING task, unless the task already exists. This makes retrying a
+# job submission, e.g. after a transient DB error or an RPC retry, a no-op
+# instead of adding duplicate task rows. A NOT EXISTS guard is used rather than
+# ON CONFLICT, as (spot_job_id, task_id) has no unique constraint, and existing
+# databases are not guaranteed to satisfy one.
+_SET_PENDING_STMT = sqlalchemy.insert(spot_table).from_select(
+    [
+        spot_table.c.spot_job_id,
+        spot_table.c.task_id,
+        spot_table.c.task_name,
+        spot_table.c.resources,
+        spot_table.c.metadata,
+        spot_table.c.status,
+    ],
+    sqlalchemy.select(
+        sqlalchemy.bindparam('b_job_id', type_=sqlalchemy.Integer),
+        sqlalchemy.bindparam('b_task_id', type_=sqlalchemy.Integer),
+        sqlalchemy.bindparam('b_task_name', type_=sqlalchemy.Text),
+        sqlalchemy.bindparam('b_resources', type_=sqlalchemy.Text),
+        sqlalchemy.bindparam('b_metadata', type_=sqlalchemy.Text),
+        sqlalchemy.literal(ManagedJobStatus.PENDING.value),
+    ).where(~sqlalchemy.exists().where(
+        sqlalchemy.and_(
+            spot_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'),
+            spot_table.c.task_id == sqlalchemy.bindparam('b_task_id'),
+        ))))
+
+
 @_init_db
 def set_pending(
     job_id: int,
@@ -766,19 +1053,43 @@ def set_pending(
     resources_str: str,
     metadata: str,
 ):
-    """Set the task to pending state."""
+    """Set the task to pending state, if it is not already recorded."""
     assert _SQLALCHEMY_ENGINE is not None
 
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
         session.execute(
-            sqlalchemy.insert(spot_table).values(
-                spot_job_id=job_id,
-                task_id=task_id,
-                task_name=task_name,
-                resources=resources_str,
-                metadata=metadata,
-                status=ManagedJobStatus.PENDING.value,
-            ))
+            _SET_PENDING_STMT, {
+                'b_job_id': job_id,
+                'b_task_id': task_id,
+                'b_task_name': task_name,
+                'b_resources': resources_str,
+                'b_metadata': metadata,
+            })
+        session.commit()
+
+
+@_init_db
+def set_pending_many(job_id: int, tasks: List[Tuple[int, str, str, str]]):
+    """Set all tasks of a job to pending state in a single transaction.
+
+    Args:
+        job_id: The job id.
+        tasks: A list of (task_id, task_name, resources_str, metadata) tuples.
+    """
+    assert _SQLALCHEMY_ENGINE is not None
+    if not tasks:
+        return
+
+    with orm.Session(_SQLALCHEMY_ENGINE) as session:
+        # Passing a list of parameter sets makes SQLAlchemy use executemany,
+        # so all the tasks are inserted with a single commit.
+        session.execute(_SET_PENDING_STMT, [{
+            'b_job_id': job_id,
+            'b_task_id': task_id,
+            'b_task_name': task_name,
+            'b_resources': resources_str,
+            'b_metadata': metadata,
+        } for task_id, task_name, resources_str, metadata in tasks])
         session.commit()
 
 
@@ -790,7 +1101,7 @@ async def set_backoff_pending_async(job_id: int, task_id: int):
     PENDING.
     """
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         result = await session.execute(
             sqlalchemy.update(spot_table).where(
                 sqlalchemy.and_(
@@ -828,7 +1139,7 @@ async def set_restarting_async(job_id: int, task_id: int, recovering: bool):
     target_status = ManagedJobStatus.STARTING.value
     if recovering:
         target_status = ManagedJobStatus.RECOVERING.value
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         result = await session.execute(
             sqlalchemy.update(spot_table).where(
                 sqlalchemy.and_(
@@ -850,6 +1161,41 @@ async def set_restarting_async(job_id: int, task_id: int, recovering: bool):
     # initial (pre-`set_backoff_pending`) transition to STARTING or RECOVERING.
 
 
+def _get_set_failed_fields(failure_type: ManagedJobStatus, failure_reason: str,
+                           end_time: float,
+                           override_terminal: bool) -> Dict[Any, Any]:
+    """Get the fields to set by set_failed and set_failed_async."""
+    if override_terminal:
+        # Prepend the new failure reason to the existing one of each task, and
+        # use COALESCE for end_at to avoid overriding the existing end_at if
+        # it's already set. Doing this in the UPDATE itself avoids reading the
+        # existing failure reason with a separate SELECT ... FOR UPDATE.
+        new_failure_reason: Any = sqlalchemy.case(
+            (sqlalchemy.func.coalesce(spot_table.c.failure_reason, '') != '',
+             sqlalchemy.literal(failure_reason + '. Previously: ',
+                                sqlalchemy.Text) + spot_table.c.failure_reason),
+            else_=failure_reason)
+        new_end_at: Any = sqlalchemy.func.coalesce(spot_table.c.end_at,
+                                                   end_time)
+    else:
+        new_failure_reason = failure_reason
+        new_end_at = end_time
+    return {
+        spot_table.c.status: failure_type.value,
+        spot_table.c.failure_reason: new_failure_reason,
+        spot_table.c.end_at: new_end_at,
+        # If the task is recovering, we should set the last_recovered_at to
+        # the end_time, so that the end_at - last_recovered_at will not be
+        # affect the job duration calculation. The expressions in SET are
+        # evaluated against the row before the update, so this checks the
+        # previous status of each task without a separate SELECT.
+        spot_table.c.last_recovered_at: sqlalchemy.case(
+            (spot_table.c.status
+             == ManagedJobStatus.RECOVERING.value, end_time),
+            else_=spot_table.c.last_recovered_at),
+    }
+
+
 @_init_db
 def set_failed(
     job_id: int,
@@ -879,43 +1225,14 @@ def set_failed(
     assert failure_type.is_failed(), failure_type
     end_time = time.time() if end_time is None else end_time
 
-    fields_to_set: Dict[str, Any] = {
-        spot_table.c.status: failure_type.value,
-        spot_table.c.failure_reason: failure_reason,
-    }
+    fields_to_set = _get_set_failed_fields(failure_type, failure_reason,
+                                           end_time, override_terminal)
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        # Get previous status
-        previous_status = session.execute(
-            sqlalchemy.select(spot_table.c.status).where(
-                spot_table.c.spot_job_id == job_id)).fetchone()[0]
-        previous_status = ManagedJobStatus(previous_status)
-        if previous_status == ManagedJobStatus.RECOVERING:
-            # If the job is recovering, we should set the last_recovered_at to
-            # the end_time, so that the end_at - last_recovered_at will not be
-            # affect the job duration calculation.
-            fields_to_set[spot_table.c.last_recovered_at] = end_time
         where_conditions = [spot_table.c.spot_job_id == job_id]
         if task_id is not None:
             where_conditions.append(spot_table.c.task_id == task_id)
 
-        # Handle failure_reason prepending when override_terminal is True
-        if override_terminal:
-            # Get existing failure_reason with row lock to prevent race
-            # conditions
-            existing_reason_result = session.execute(
-                sqlalchemy.select(spot_table.c.failure_reason).where(
-                    sqlalchemy.and_(*where_conditions)).with_for_update())
-            existing_reason_row = existing_reason_result.fetchone()
-            if existing_reason_row and existing_reason_row[0]:
-                # Prepend new failure reason to existing one
-                fields_to_set[spot_table.c.failure_reason] = (
-                    failure_reason + '. Previously: ' + existing_reason_row[0])
-            # Use COALESCE for end_at to avoid overriding the existing end_at if
-            # it's already set.
-            fields_to_set[spot_table.c.end_at] = sqlalchemy.func.coalesce(
-                spot_table.c.end_at, end_time)
-        else:
-            fields_to_set[spot_table.c.end_at] = end_time
+        if not override_terminal:
             where_conditions.append(spot_table.c.end_at.is_(None))
         count = session.query(spot_table).filter(
             sqlalchemy.and_(*where_conditions)).update(fields_to_set)
@@ -971,7 +1288,12 @@ def set_local_log_file(job_id: int, task_id: Optional[int],
     """Set the local log file for a job."""
     assert _SQLALCHEMY_ENGINE is not None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        where_conditions = [spot_table.c.spot_job_id == job_id]
+        where_conditions = [
+            spot_table.c.spot_job_id == job_id,
+            # Skip the rows that already have this log file, so that setting
+            # it again does not write to the database.
+            spot_table.c.local_log_file.is_distinct_from(local_log_file),
+        ]
         if task_id is not None:
             where_conditions.append(spot_table.c.task_id == task_id)
         session.query(spot_table).filter(
@@ -980,6 +1302,37 @@ def set_local_log_file(job_id: int, task_id: Optional[int],
         session.commit()
 
 
+def _job_ids_stmt(*conditions):
+    """Select the distinct job ids matching all conditions, newest first."""
+    query = sqlalchemy.select(spot_table.c.spot_job_id.distinct()).select_from(
+        spot_table.outerjoin(
+            job_info_table,
+            spot_table.c.spot_job_id == job_info_table.c.spot_job_id))
+    if conditions:
+        query = query.where(sqlalchemy.and_(*conditions))
+    return query.order_by(spot_table.c.spot_job_id.desc())
+
+
+_IS_NONTERMINAL = ~_task_status_in(ManagedJobStatus.terminal_statuses())
+
+# We match the job name from `job_info` for the jobs submitted after #1982, and
+# from `spot` for the jobs submitted before #1982, whose job_info is not
+# available.
+_JOB_NAME_MATCHES = sqlalchemy.or_(
+    job_info_table.c.name == sqlalchemy.bindparam('b_name'),
+    sqlalchemy.and_(job_info_table.c.name.is_(None),
+                    spot_table.c.task_name == sqlalchemy.bindparam('b_name')))
+
+_GET_NONTERMINAL_JOB_IDS_STMT = _job_ids_stmt(_IS_NONTERMINAL)
+
+_GET_NONTERMINAL_JOB_IDS_BY_USER_STMT = _job_ids_stmt(
+    _IS_NONTERMINAL,
+    job_info_table.c.user_hash == sqlalchemy.bindparam('b_user_hash'))
+
+_GET_NONTERMINAL_JOB_IDS_BY_NAME_STMT = _job_ids_stmt(_IS_NONTERMINAL,
+                                                      _JOB_NAME_MATCHES)
+
+
 # ======== utility functions ========
 @_init_db
 def get_nonterminal_job_ids_by_name(name: Optional[str],
@@ -994,19 +1347,12 @@ def get_nonterminal_job_ids_by_name(name: Optional[str],
     assert _SQLALCHEMY_ENGINE is not None
 
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        # Build the query using SQLAlchemy core
-        query = sqlalchemy.select(
-            spot_table.c.spot_job_id.distinct()).select_from(
-                spot_table.outerjoin(
-                    job_info_table,
-                    spot_table.c.spot_job_id == job_info_table.c.spot_job_id,
-                ))
-        where_conditions = [
-            ~spot_table.c.status.in_([
-                status.value for status in ManagedJobStatus.terminal_statuses()
-            ])
-        ]
-        if name is None and not all_users:
+        if name is not None:
+            result = session.execute(_GET_NONTERMINAL_JOB_IDS_BY_NAME_STMT,
+                                     {'b_name': name})
+        elif all_users:
+            result = session.execute(_GET_NONTERMINAL_JOB_IDS_STMT)
+        else:
             if user_hash is None:
                 # For backwards compatibility. With codegen, USER_ID_ENV_VAR
                 # was set to the correct value by the jobs controller, as
@@ -1015,22 +1361,37 @@ def get_nonterminal_job_ids_by_name(name: Optional[str],
                 # pass it explicitly through the request body.
                 logger.debug('user_hash is None, using current user hash')
                 user_hash = common_utils.get_user_hash()
-            where_conditions.append(job_info_table.c.user_hash == user_hash)
-        if name is not None:
-            # We match the job name from `job_info` for the jobs submitted after
-            # #1982, and from `spot` for the jobs submitted before #1982, whose
-            # job_info is not available.
-            where_conditions.append(
+            result = session.execute(_GET_NONTERMINAL_JOB_IDS_BY_USER_STMT,
+                                     {'b_user_hash': user_hash})
+        return [row[0] for row in result if row[0] is not None]
+
+
+def _build_get_jobs_to_check_status_stmt():
+    # Get jobs that are either:
+    # 1. Have schedule state that is not DONE, or
+    # 2. Have schedule state DONE AND are in non-terminal status (unexpected
+    #    inconsistent state), or
+    # 3. Have no schedule state (legacy) AND are in non-terminal status
+    # Legacy jobs are handled the same way as DONE jobs, so treat a NULL
+    # schedule state as DONE instead of checking for it separately.
+    schedule_state = sqlalchemy.func.coalesce(
+        job_info_table.c.schedule_state,
+        sqlalchemy.literal(ManagedJobScheduleState.DONE.value))
+    return sqlalchemy.select(spot_table.c.spot_job_id.distinct()).select_from(
+        spot_table.outerjoin(
+            job_info_table,
+            spot_table.c.spot_job_id == job_info_table.c.spot_job_id)).where(
                 sqlalchemy.or_(
-                    job_info_table.c.name == name,
-                    sqlalchemy.and_(job_info_table.c.name.is_(None),
-                                    spot_table.c.task_name == name),
-                ))
-        query = query.where(sqlalchemy.and_(*where_conditions)).order_by(
-            spot_table.c.spot_job_id.desc())
-        rows = session.execute(query).fetchall()
-        job_ids = [row[0] for row in rows if row[0] is not None]
-        return job_ids
+                    schedule_state != sqlalchemy.literal(
+                        ManagedJobScheduleState.DONE.value),
+                    ~_task_status_in(ManagedJobStatus.terminal_statuses()),
+                )).order_by(spot_table.c.spot_job_id.desc())
+
+
+_GET_JOBS_TO_CHECK_STATUS_STMT = _build_get_jobs_to_check_status_stmt()
+
+_GET_JOB_TO_CHECK_STATUS_STMT = _GET_JOBS_TO_CHECK_STATUS_STMT.where(
+    spot_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'))
 
 
 @_init_db
@@ -1048,63 +1409,12 @@ def get_jobs_to_check_status(job_id: Optional[int] = None) -> List[int]:
     assert _SQLALCHEMY_ENGINE is not None
 
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        terminal_status_values = [
-            status.value for status in ManagedJobStatus.terminal_statuses()
-        ]
-
-        query = sqlalchemy.select(
-            spot_table.c.spot_job_id.distinct()).select_from(
-                spot_table.outerjoin(
-                    job_info_table,
-                    spot_table.c.spot_job_id == job_info_table.c.spot_job_id))
-
-        # Get jobs that are either:
-        # 1. Have schedule state that is not DONE, or
-        # 2. Have schedule state DONE AND are in non-terminal status (unexpected
-        #    inconsistent state), or
-        # 3. Have no schedule state (legacy) AND are in non-terminal status
-
-        # non-legacy jobs that are not DONE
-        condition1 = sqlalchemy.and_(
-            job_info_table.c.schedule_state.is_not(None),
-            job_info_table.c.schedule_state !=
-            ManagedJobScheduleState.DONE.value)
-        # legacy or that are in non-terminal status or
-        # DONE jobs that are in non-terminal status
-        condition2 = sqlalchemy.and_(
-            sqlalchemy.or_(
-                # legacy jobs
-                job_info_table.c.schedule_state.is_(None),
-                # non-legacy DONE jobs
-                job_info_table.c.schedule_state ==
-                ManagedJobScheduleState.DONE.value),
-            # non-terminal
-            ~spot_table.c.status.in_(terminal_status_values),
-        )
-        where_condition = sqlalchemy.or_(condition1, condition2)
-        if job_id is not None:
-            where_condition = sqlalchemy.and_(
-                where_condition, spot_table.c.spot_job_id == job_id)
-
-        query = query.where(where_condition).order_by(
-            spot_table.c.spot_job_id.desc())
-
-        rows = session.execute(query).fetchall()
-        return [row[0] for row in rows if row[0] is not None]
-
-
-@_init_db
-def _get_all_task_ids_statuses(
-        job_id: int) -> List[Tuple[int, ManagedJobStatus]]:
-    assert _SQLALCHEMY_ENGINE is not None
-    with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        id_statuses = session.execute(
-            sqlalchemy.select(
-                spot_table.c.task_id,
-                spot_table.c.status,
-            ).where(spot_table.c.spot_job_id == job_id).order_by(
-                spot_table.c.task_id.asc())).fetchall()
-        return [(row[0], ManagedJobStatus(row[1])) for row in id_statuses]
+        if job_id is None:
+            result = session.execute(_GET_JOBS_TO_CHECK_STATUS_STMT)
+        else:
+            result = session.execute(_GET_JOB_TO_CHECK_STATUS_STMT,
+                                     {'b_job_id': job_id})
+        return [row[0] for row in result if row[0] is not None]
 
 
 @_init_db
@@ -1126,10 +1436,40 @@ def get_all_task_ids_names_statuses_logs(
                 for row in id_names]
 
 
+_GET_NUM_TASKS_STMT = sqlalchemy.select(
+    sqlalchemy.func.count()  # pylint: disable=not-callable
+).select_from(spot_table).where(
+    spot_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'))
+
+
+@_init_db
 def get_num_tasks(job_id: int) -> int:
-    return len(_get_all_task_ids_statuses(job_id))
+    assert _SQLALCHEMY_ENGINE is not None
+    with orm.Session(_SQLALCHEMY_ENGINE) as session:
+        return session.execute(_GET_NUM_TASKS_STMT, {
+            'b_job_id': job_id
+        }).fetchone()[0]
+
+
+def _build_get_latest_task_id_status_stmt():
+    # The latest task is the first non-terminal task, or the last task if all
+    # of them are terminal. Order the tasks so that it comes first, instead of
+    # fetching all the tasks of the job.
+    is_terminal = _task_status_in(ManagedJobStatus.terminal_statuses())
+    return sqlalchemy.select(
+        spot_table.c.task_id,
+        spot_table.c.status,
+    ).where(
+        spot_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id')).order_by(
+            sqlalchemy.case((is_terminal, 1), else_=0),
+            sqlalchemy.case((is_terminal, -spot_table.c.task_id),
+                            else_=spot_table.c.task_id)).limit(1)
+
 
+_GET_LATEST_TASK_ID_STATUS_STMT = _build_get_latest_task_id_status_stmt()
 
+
+@_init_db
 def get_latest_task_id_status(
         job_id: int) -> Union[Tuple[int, ManagedJobStatus], Tuple[None, None]]:
     """Returns the (task id, status) of the latest task of a job.
@@ -1141,16 +1481,14 @@ def get_latest_task_id_status(
 
     If the job_id does not exist, (None, None) will be returned.
     """
-    id_statuses = _get_all_task_ids_statuses(job_id)
-    if not id_statuses:
+    assert _SQLALCHEMY_ENGINE is not None
+    with orm.Session(_SQLALCHEMY_ENGINE) as session:
+        row = session.execute(_GET_LATEST_TASK_ID_STATUS_STMT, {
+            'b_job_id': job_id
+        }).fetchone()
+    if row is None:
         return None, None
-    task_id, status = next(
-        ((tid, st) for tid, st in id_statuses if not st.is_terminal()),
-        id_statuses[-1],
-    )
-    # Unpack the tuple first, or it triggers a Pylint's bug on recognizing
-    # the return type.
-    return task_id, status
+    return row[0], ManagedJobStatus(row[1])
 
 
 @_init_db
@@ -1213,6 +1551,13 @@ def get_status(job_id: int) -> Optional[ManagedJobStatus]:
     return status
 
 
+_GET_FAILURE_REASON_STMT = sqlalchemy.select(spot_table.c.failure_reason).where(
+    sqlalchemy.and_(
+        spot_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'),
+        spot_table.c.failure_reason.isnot(None),
+    )).order_by(spot_table.c.task_id.asc()).limit(1)
+
+
 @_init_db
 def get_failure_reason(job_id: int) -> Optional[str]:
     """Get the failure reason of a job.
@@ -1221,62 +1566,100 @@ def get_failure_reason(job_id: int) -> Optional[str]:
     """
     assert _SQLALCHEMY_ENGINE is not None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        reason = session.execute(
-            sqlalchemy.select(spot_table.c.failure_reason).where(
-                spot_table.c.spot_job_id == job_id).order_by(
-                    spot_table.c.task_id.asc())).fetchall()
-        reason = [r[0] for r in reason if r[0] is not None]
-        if not reason:
-            return None
-        return reason[0]
+        return session.execute(_GET_FAILURE_REASON_STMT, {
+            'b_job_id': job_id
+        }).scalar()
+
+
+def _read_user_yaml(yaml_path: str) -> Optional[str]:
+    try:
+        with open(yaml_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except (FileNotFoundError, IOError, OSError) as e:
+        logger.debug(f'Failed to read original user YAML from {yaml_path}: {e}')
+        return None
+
+
+def _add_user_yamls(job_dicts: List[Dict[str, Any]]) -> None:
+    """Set 'user_yaml' on each of the job dicts.
+
+    Jobs submitted before the YAML content was stored in the DB only have the
+    path to the YAML file. Each of these files is read once, even if it is
+    shared by the tasks of a job, and the reads run in parallel.
+    """
+    yaml_paths = set()
+    for job_dict in job_dicts:
+        job_dict['user_yaml'] = job_dict.get('original_user_yaml_content')
+        if job_dict['user_yaml'] is None:
+            # Backwards compatibility - read from the file path.
+            yaml_path = job_dict.get('original_user_yaml_path')
+            if yaml_path:
+                yaml_paths.add(yaml_path)
+    if not yaml_paths:
+        return
+    yaml_paths_list = list(yaml_paths)
+    user_yamls = dict(
+        zip(yaml_paths_list,
+            subprocess_utils.run_in_parallel(_read_user_yaml, yaml_paths_list)))
+    for job_dict in job_dicts:
+        if job_dict['user_yaml'] is None:
+            yaml_path = job_dict.get('original_user_yaml_path')
+            if yaml_path:
+                job_dict['user_yaml'] = user_yamls[yaml_path]
+
+
+# Join spot and job_info tables to get the job name for each task.
+# We use LEFT OUTER JOIN mainly for backward compatibility, as for an
+# existing controller before #1982, the job_info table may not exist,
+# and all the managed jobs created before will not present in the
+# job_info.
+_GET_MANAGED_JOB_TASKS_STMT = sqlalchemy.select(
+    spot_table, job_info_table).select_from(
+        spot_table.outerjoin(
+            job_info_table,
+            spot_table.c.spot_job_id == job_info_table.c.spot_job_id)).where(
+                spot_table.c.spot_job_id == sqlalchemy.bindparam(
+                    'b_job_id')).order_by(spot_table.c.task_id.asc())
 
 
 @_init_db
-def get_managed_job_tasks(job_id: int) -> List[Dict[str, Any]]:
-    """Get managed job tasks for a specific managed job id from the database."""
+def get_managed_job_tasks(
+        job_id: int,
+        fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Get managed job tasks for a specific managed job id from the database.
+
+    Args:
+        job_id: The managed job id.
+        fields: The fields to read from the database. The other fields of the
+            returned dicts are None. If None, read all the fields, including
+            the potentially large YAML, env file and config file contents.
+    """
     assert _SQLALCHEMY_ENGINE is not None
 
-    # Join spot and job_info tables to get the job name for each task.
-    # We use LEFT OUTER JOIN mainly for backward compatibility, as for an
-    # existing controller before #1982, the job_info table may not exist,
-    # and all the managed jobs created before will not present in the
-    # job_info.
     # Note: we will get the user_hash here, but don't try to call
     # global_user_state.get_user() on it. This runs on the controller, which may
     # not have the user info. Prefer to do it on the API server side.
-    query = sqlalchemy.select(spot_table, job_info_table).select_from(
-        spot_table.outerjoin(
-            job_info_table,
-            spot_table.c.spot_job_id == job_info_table.c.spot_job_id))
-    query = query.where(spot_table.c.spot_job_id == job_id)
-    query = query.order_by(spot_table.c.task_id.asc())
+    query = _GET_MANAGED_JOB_TASKS_STMT
+    if fields:
+        query = query.with_only_columns(
+            *[_map_response_field_to_db_column(f) for f in fields])
     rows = None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        rows = session.execute(query).fetchall()
+        rows = session.execute(query, {'b_job_id': job_id}).fetchall()
     jobs = []
-    for row in rows:
-        job_dict = _get_jobs_dict(row._mapping)  # pylint: disable=protected-access
-        job_dict['status'] = ManagedJobStatus(job_dict['status'])
-        job_dict['schedule_state'] = ManagedJobScheduleState(
-            job_dict['schedule_state'])
+    for job_dict in _get_jobs_dicts(rows, query.selected_columns):
+        if job_dict['status'] is not None:
+            job_dict['status'] = ManagedJobStatus(job_dict['status'])
+        if job_dict['schedule_state'] is not None:
+            job_dict['schedule_state'] = ManagedJobScheduleState(
+                job_dict['schedule_state'])
         if job_dict['job_name'] is None:
             job_dict['job_name'] = job_dict['task_name']
-        job_dict['metadata'] = json.loads(job_dict['metadata'])
-
-        # Add user YAML content for managed jobs.
-        job_dict['user_yaml'] = job_dict.get('original_user_yaml_content')
-        if job_dict['user_yaml'] is None:
-            # Backwards compatibility - try to read from file path
-            yaml_path = job_dict.get('original_user_yaml_path')
-            if yaml_path:
-                try:
-                    with open(yaml_path, 'r', encoding='utf-8') as f:
-                        job_dict['user_yaml'] = f.read()
-                except (FileNotFoundError, IOError, OSError) as e:
-                    logger.debug('Failed to read original user YAML for job '
-                                 f'{job_id} from {yaml_path}: {e}')
-
+        if job_dict['metadata'] is not None:
+            job_dict['metadata'] = json.loads(job_dict['metadata'])
         jobs.append(job_dict)
+    # Add user YAML content for managed jobs.
+    _add_user_yamls(jobs)
     return jobs
 
 
@@ -1377,15 +1760,12 @@ def build_managed_jobs_with_filters_no_status_query(
         # partially finished, include all its tasks. We do this by first
         # selecting job_ids that have at least one non-terminal task, then
         # restricting the main query to those job_ids.
-        terminal_status_values = [
-            s.value for s in ManagedJobStatus.terminal_statuses()
-        ]
         non_terminal_job_ids_subquery = (sqlalchemy.select(
             spot_table.c.spot_job_id).where(
                 sqlalchemy.or_(
                     spot_table.c.status.is_(None),
                     sqlalchemy.not_(
-                        spot_table.c.status.in_(terminal_status_values)),
+                        spot_table.c.status.in_(_TERMINAL_SPOT_STATUS_VALUES)),
                 )).distinct())
         query = query.where(
             spot_table.c.spot_job_id.in_(non_terminal_job_ids_subquery))
@@ -1531,8 +1911,7 @@ def get_managed_jobs_with_filters(
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
         rows = session.execute(query).fetchall()
     jobs = []
-    for row in rows:
-        job_dict = _get_jobs_dict(row._mapping)  # pylint: disable=protected-access
+    for job_dict in _get_jobs_dicts(rows, query.selected_columns):
         if job_dict.get('status') is not None:
             job_dict['status'] = ManagedJobStatus(job_dict['status'])
         if job_dict.get('schedule_state') is not None:
@@ -1542,26 +1921,9 @@ def get_managed_jobs_with_filters(
             job_dict['job_name'] = job_dict.get('task_name')
         if job_dict.get('metadata') is not None:
             job_dict['metadata'] = json.loads(job_dict['metadata'])
-
-        # Add user YAML content for managed jobs.
-        job_dict['user_yaml'] = job_dict.get('original_user_yaml_content')
-        if job_dict['user_yaml'] is None:
-            # Backwards compatibility - try to read from file path
-            yaml_path = job_dict.get('original_user_yaml_path')
-            if yaml_path:
-                try:
-                    with open(yaml_path, 'r', encoding='utf-8') as f:
-                        job_dict['user_yaml'] = f.read()
-                except (FileNotFoundError, IOError, OSError) as e:
-                    job_id = job_dict.get('job_id')
-                    if job_id is not None:
-                        logger.debug('Failed to read original user YAML for '
-                                     f'job {job_id} from {yaml_path}: {e}')
-                    else:
-                        logger.debug('Failed to read original user YAML from '
-                                     f'{yaml_path}: {e}')
-
         jobs.append(job_dict)
+    # Add user YAML content for managed jobs.
+    _add_user_yamls(jobs)
     return jobs, total
 
 
@@ -1686,7 +2048,7 @@ async def set_job_id_on_pool_cluster_async(job_id: int,
                                            job_id_on_pool_cluster: int) -> None:
     """Set the job id on the pool cluster for a job."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         await session.execute(
             sqlalchemy.update(job_info_table).
             where(job_info_table.c.spot_job_id == job_id).values({
@@ -1726,38 +2088,62 @@ async def get_pool_submit_info_async(
         return info[0], info[1]
 
 
-@_init_db_async
-async def scheduler_set_launching_async(job_id: int):
+def _scheduler_transition_stmt(
+        new_state: ManagedJobScheduleState,
+        from_states: Optional[List[ManagedJobScheduleState]] = None):
+    """Build the UPDATE that moves job b_job_id to new_state.
+
+    If from_states is given, only a job currently in one of them is updated,
+    so the caller can check the transition was valid from the row count.
+    """
+    condition = job_info_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id')
+    if from_states is not None:
+        condition = sqlalchemy.and_(
+            condition,
+            job_info_table.c.schedule_state.in_(
+                [sqlalchemy.literal(state.value) for state in from_states]))
+    return sqlalchemy.update(job_info_table).where(condition).values(
+        {job_info_table.c.schedule_state: new_state.value})
+
+
+async def _transition_schedule_state_async(stmt, job_id: int) -> int:
+    """Run a prebuilt schedule state transition and return the changed rows."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        await session.execute(
-            sqlalchemy.update(job_info_table).where(
-                sqlalchemy.and_(job_info_table.c.spot_job_id == job_id)).values(
-                    {
-                        job_info_table.c.schedule_state:
-                            ManagedJobScheduleState.LAUNCHING.value
-                    }))
+    async with _async_write_session() as session:
+        result = await session.execute(stmt, {'b_job_id': job_id})
         await session.commit()
+        return result.rowcount
+
+
+_SCHEDULER_SET_LAUNCHING_STMT = _scheduler_transition_stmt(
+    ManagedJobScheduleState.LAUNCHING)
+
+
+@_init_db_async
+async def scheduler_set_launching_async(job_id: int):
+    await _transition_schedule_state_async(_SCHEDULER_SET_LAUNCHING_STMT,
+                                           job_id)
+
+
+_SCHEDULER_SET_ALIVE_STMT = _scheduler_transition_stmt(
+    ManagedJobScheduleState.ALIVE, [ManagedJobScheduleState.LAUNCHING])
 
 
 @_init_db_async
 async def scheduler_set_alive_async(job_id: int) -> None:
     """Do not call without holding the scheduler lock."""
-    assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.update(job_info_table).where(
-                sqlalchemy.and_(
-                    job_info_table.c.spot_job_id == job_id,
-                    job_info_table.c.schedule_state ==
-                    ManagedJobScheduleState.LAUNCHING.value,
-                )).values({
-                    job_info_table.c.schedule_state:
-                        ManagedJobScheduleState.ALIVE.value
-                }))
-        changes = result.rowcount
-        await session.commit()
-        assert changes == 1, (job_id, changes)
+    changes = await _transition_schedule_state_async(_SCHEDULER_SET_ALIVE_STMT,
+                                                     job_id)
+    assert changes == 1, (job_id, changes)
+
+
+_SCHEDULER_SET_DONE_STMT = sqlalchemy.update(job_info_table).where(
+    sqlalchemy.and_(
+        job_info_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'),
+        job_info_table.c.schedule_state != sqlalchemy.literal(
+            ManagedJobScheduleState.DONE.value),
+    )).values(
+        {job_info_table.c.schedule_state: ManagedJobScheduleState.DONE.value})
 
 
 @_init_db
@@ -1765,67 +2151,72 @@ def scheduler_set_done(job_id: int, idempotent: bool = False) -> None:
     """Do not call without holding the scheduler lock."""
     assert _SQLALCHEMY_ENGINE is not None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        updated_count = session.query(job_info_table).filter(
-            sqlalchemy.and_(
-                job_info_table.c.spot_job_id == job_id,
-                job_info_table.c.schedule_state !=
-                ManagedJobScheduleState.DONE.value,
-            )).update({
-                job_info_table.c.schedule_state:
-                    ManagedJobScheduleState.DONE.value
-            })
+        updated_count = session.execute(_SCHEDULER_SET_DONE_STMT, {
+            'b_job_id': job_id
+        }).rowcount
         session.commit()
         if not idempotent:
             assert updated_count == 1, (job_id, updated_count)
 
 
+_GET_SCHEDULE_STATE_STMT = sqlalchemy.select(
+    job_info_table.c.schedule_state).where(
+        job_info_table.c.spot_job_id == sqlalchemy.bindparam('b_job_id'))
+
+
 @_init_db
 def get_job_schedule_state(job_id: int) -> ManagedJobScheduleState:
     assert _SQLALCHEMY_ENGINE is not None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        state = session.execute(
-            sqlalchemy.select(job_info_table.c.schedule_state).where(
-                job_info_table.c.spot_job_id == job_id)).fetchone()[0]
+        state = session.execute(_GET_SCHEDULE_STATE_STMT, {
+            'b_job_id': job_id
+        }).fetchone()[0]
         return ManagedJobScheduleState(state)
 
 
+_GET_NUM_LAUNCHING_JOBS_STMT = sqlalchemy.select(
+    sqlalchemy.func.count()  # pylint: disable=not-callable
+).select_from(job_info_table).where(
+    sqlalchemy.and_(
+        job_info_table.c.schedule_state == sqlalchemy.literal(
+            ManagedJobScheduleState.LAUNCHING.value),
+        # We only count jobs that are not in the pool, because the job in the
+        # pool does not actually calling the sky.launch.
+        job_info_table.c.pool.is_(None)))
+
+
 @_init_db
 def get_num_launching_jobs() -> int:
     assert _SQLALCHEMY_ENGINE is not None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        return session.execute(
-            sqlalchemy.select(
-                sqlalchemy.func.count()  # pylint: disable=not-callable
-            ).select_from(job_info_table).where(
-                sqlalchemy.and_(
-                    job_info_table.c.schedule_state ==
-                    ManagedJobScheduleState.LAUNCHING.value,
-                    # We only count jobs that are not in the pool, because the
-                    # job in the pool does not actually calling the sky.launch.
-                    job_info_table.c.pool.is_(None)))).fetchone()[0]
+        return session.execute(_GET_NUM_LAUNCHING_JOBS_STMT).fetchone()[0]
+
+
+_GET_NUM_ALIVE_JOBS_STMT = sqlalchemy.select(
+    sqlalchemy.func.count()  # pylint: disable=not-callable
+).select_from(job_info_table).where(
+    job_info_table.c.schedule_state.in_([
+        sqlalchemy.literal(state.value) for state in [
+            ManagedJobScheduleState.ALIVE_WAITING,
+            ManagedJobScheduleState.LAUNCHING,
+            ManagedJobScheduleState.ALIVE,
+            ManagedJobScheduleState.ALIVE_BACKOFF,
+        ]
+    ]))
+
+_GET_NUM_ALIVE_JOBS_IN_POOL_STMT = _GET_NUM_ALIVE_JOBS_STMT.where(
+    job_info_table.c.pool == sqlalchemy.bindparam('b_pool'))
 
 
 @_init_db
 def get_num_alive_jobs(pool: Optional[str] = None) -> int:
     assert _SQLALCHEMY_ENGINE is not None
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        where_conditions = [
-            job_info_table.c.schedule_state.in_([
-                ManagedJobScheduleState.ALIVE_WAITING.value,
-                ManagedJobScheduleState.LAUNCHING.value,
-                ManagedJobScheduleState.ALIVE.value,
-                ManagedJobScheduleState.ALIVE_BACKOFF.value,
-            ])
-        ]
-
-        if pool is not None:
-            where_conditions.append(job_info_table.c.pool == pool)
-
-        return session.execute(
-            sqlalchemy.select(
-                sqlalchemy.func.count()  # pylint: disable=not-callable
-            ).select_from(job_info_table).where(
-                sqlalchemy.and_(*where_conditions))).fetchone()[0]
+        if pool is None:
+            return session.execute(_GET_NUM_ALIVE_JOBS_STMT).fetchone()[0]
+        return session.execute(_GET_NUM_ALIVE_JOBS_IN_POOL_STMT, {
+            'b_pool': pool
+        }).fetchone()[0]
 
 
 @_init_db
@@ -1842,9 +2233,7 @@ def get_nonterminal_job_ids_by_pool(pool: str,
                     job_info_table,
                     spot_table.c.spot_job_id == job_info_table.c.spot_job_id))
         and_conditions = [
-            ~spot_table.c.status.in_([
-                status.value for status in ManagedJobStatus.terminal_statuses()
-            ]),
+            ~spot_table.c.status.in_(_TERMINAL_SPOT_STATUS_VALUES),
             job_info_table.c.pool == pool,
         ]
         if cluster_name is not None:
@@ -1852,9 +2241,44 @@ def get_nonterminal_job_ids_by_pool(pool: str,
                 job_info_table.c.current_cluster_name == cluster_name)
         query = query.where(sqlalchemy.and_(*and_conditions)).order_by(
             spot_table.c.spot_job_id.asc())
-        rows = session.execute(query).fetchall()
-        job_ids = [row[0] for row in rows if row[0] is not None]
-        return job_ids
+        return [row[0] for row in session.execute(query) if row[0] is not None]
+
+
+_IS_WAITING = job_info_table.c.schedule_state == sqlalchemy.literal(
+    ManagedJobScheduleState.WAITING.value)
+
+_HIGHEST_PRIORITY_FIRST = (
+    job_info_table.c.priority.desc(),
+    job_info_table.c.spot_job_id.asc(),
+)
+
+_LAUNCHING_VALUES = {
+    job_info_table.c.schedule_state: ManagedJobScheduleState.LAUNCHING.value,
+    job_info_table.c.controller_pid: sqlalchemy.bindparam('b_pid'),
+    job_info_table.c.controller_pid_started_at:
+        sqlalchemy.bindparam('b_pid_started_at'),
+}
+
+# Selects the highest priority waiting job for update (locks the row).
+_GET_WAITING_JOB_STMT = sqlalchemy.select(
+    job_info_table.c.spot_job_id,
+    job_info_table.c.schedule_state,
+    job_info_table.c.pool,
+).where(_IS_WAITING).order_by(
+    *_HIGHEST_PRIORITY_FIRST).limit(1).with_for_update()
+
+# Picks the highest priority waiting job and sets it to LAUNCHING in a single
+# statement, if the database supports UPDATE ... RETURNING. The schedule state
+# is checked again on the row itself, so that a job picked at the same time by
+# another scheduler is not launched twice.
+_LAUNCH_WAITING_JOB_STMT = sqlalchemy.update(job_info_table).where(
+    sqlalchemy.and_(
+        job_info_table.c.spot_job_id == sqlalchemy.select(
+            job_info_table.c.spot_job_id).where(_IS_WAITING).order_by(
+                *_HIGHEST_PRIORITY_FIRST).limit(1).scalar_subquery(),
+        _IS_WAITING,
+    )).values(_LAUNCHING_VALUES).returning(job_info_table.c.spot_job_id,
+                                           job_info_table.c.pool)
 
 
 @_init_db_async
@@ -1872,22 +2296,23 @@ async def get_waiting_job_async(
     schedule_state and will be ignored by this SQL query.
     """
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        # Select the highest priority waiting job for update (locks the row)
-        select_query = sqlalchemy.select(
-            job_info_table.c.spot_job_id,
-            job_info_table.c.schedule_state,
-            job_info_table.c.pool,
-        ).where(
-            job_info_table.c.schedule_state.in_([
-                ManagedJobScheduleState.WAITING.value,
-            ])).order_by(
-                job_info_table.c.priority.desc(),
-                job_info_table.c.spot_job_id.asc(),
-            ).limit(1).with_for_update()
+    params = {'b_pid': pid, 'b_pid_started_at': pid_started_at}
+    # SQLAlchemy only enables this for SQLite 3.35.0+.
+    update_returning = _SQLALCHEMY_ENGINE_ASYNC.dialect.update_returning
+    async with _async_write_session(immediate=not update_returning) as session:
+        if update_returning:
+            result = await session.execute(_LAUNCH_WAITING_JOB_STMT, params)
+            launched_job_row = result.fetchone()
+            await session.commit()
+            if launched_job_row is None:
+                return None
+            return {
+                'job_id': launched_job_row[0],
+                'pool': launched_job_row[1],
+            }
 
         # Execute the select with row locking
-        result = await session.execute(select_query)
+        result = await session.execute(_GET_WAITING_JOB_STMT)
         waiting_job_row = result.fetchone()
 
         if waiting_job_row is None:
@@ -1903,12 +2328,7 @@ async def get_waiting_job_async(
                 sqlalchemy.and_(
                     job_info_table.c.spot_job_id == job_id,
                     job_info_table.c.schedule_state == current_state.value,
-                )).values({
-                    job_info_table.c.schedule_state:
-                        ManagedJobScheduleState.LAUNCHING.value,
-                    job_info_table.c.controller_pid: pid,
-                    job_info_table.c.controller_pid_started_at: pid_started_at,
-                }))
+                )).values(_LAUNCHING_VALUES), params)
 
         if update_result.rowcount != 1:
             # Update failed, rollback and return None
@@ -1944,23 +2364,23 @@ async def get_latest_task_id_status_async(
     """Returns the (task id, status) of the latest task of a job."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
     async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.select(
-                spot_table.c.task_id,
-                spot_table.c.status,
-            ).where(spot_table.c.spot_job_id == job_id).order_by(
-                spot_table.c.task_id.asc()))
-        id_statuses = [
-            (row[0], ManagedJobStatus(row[1])) for row in result.fetchall()
-        ]
-
-    if not id_statuses:
+        result = await session.execute(_GET_LATEST_TASK_ID_STATUS_STMT,
+                                       {'b_job_id': job_id})
+        row = result.fetchone()
+    if row is None:
         return None, None
-    task_id, status = next(
-        ((tid, st) for tid, st in id_statuses if not st.is_terminal()),
-        id_statuses[-1],
-    )
-    return task_id, status
+    return row[0], ManagedJobStatus(row[1])
+
+
+_SET_STARTING_STMT = sqlalchemy.update(spot_table).where(
+    _task_transition_condition(
+        spot_table.c.status == ManagedJobStatus.PENDING.value)).values({
+            spot_table.c.resources: sqlalchemy.bindparam('b_resources'),
+            spot_table.c.submitted_at: sqlalchemy.bindparam('b_submit_time'),
+            spot_table.c.status: ManagedJobStatus.STARTING.value,
+            spot_table.c.run_timestamp: sqlalchemy.bindparam('b_run_timestamp'),
+            spot_table.c.specs: sqlalchemy.bindparam('b_specs'),
+        })
 
 
 @_init_db_async
@@ -1971,21 +2391,18 @@ async def set_starting_async(job_id: int, task_id: int, run_timestamp: str,
     """Set the task to starting state."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
     logger.info('Launching the spot cluster...')
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.update(spot_table).where(
-                sqlalchemy.and_(
-                    spot_table.c.spot_job_id == job_id,
-                    spot_table.c.task_id == task_id,
-                    spot_table.c.status == ManagedJobStatus.PENDING.value,
-                    spot_table.c.end_at.is_(None),
-                )).values({
-                    spot_table.c.resources: resources_str,
-                    spot_table.c.submitted_at: submit_time,
-                    spot_table.c.status: ManagedJobStatus.STARTING.value,
-                    spot_table.c.run_timestamp: run_timestamp,
-                    spot_table.c.specs: json.dumps(specs),
-                }))
+    # Serialize before opening the session, so that it is not done while
+    # holding the write lock.
+    params = {
+        'b_job_id': job_id,
+        'b_task_id': task_id,
+        'b_resources': resources_str,
+        'b_submit_time': submit_time,
+        'b_run_timestamp': run_timestamp,
+        'b_specs': json.dumps(specs),
+    }
+    async with _async_write_session() as session:
+        result = await session.execute(_SET_STARTING_STMT, params)
         count = result.rowcount
         await session.commit()
         if count != 1:
@@ -1999,28 +2416,29 @@ async def set_starting_async(job_id: int, task_id: int, run_timestamp: str,
     await callback_func('STARTING')
 
 
+_SET_STARTED_STMT = sqlalchemy.update(spot_table).where(
+    _task_transition_condition(
+        _task_status_in(
+            [ManagedJobStatus.STARTING, ManagedJobStatus.PENDING]))).values({
+                spot_table.c.status: ManagedJobStatus.RUNNING.value,
+                spot_table.c.start_at: sqlalchemy.bindparam('b_start_time'),
+                spot_table.c.last_recovered_at:
+                    sqlalchemy.bindparam('b_start_time'),
+            })
+
+
 @_init_db_async
 async def set_started_async(job_id: int, task_id: int, start_time: float,
                             callback_func: AsyncCallbackType):
     """Set the task to started state."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
     logger.info('Job started.')
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.update(spot_table).where(
-                sqlalchemy.and_(
-                    spot_table.c.spot_job_id == job_id,
-                    spot_table.c.task_id == task_id,
-                    spot_table.c.status.in_([
-                        ManagedJobStatus.STARTING.value,
-                        ManagedJobStatus.PENDING.value
-                    ]),
-                    spot_table.c.end_at.is_(None),
-                )).values({
-                    spot_table.c.status: ManagedJobStatus.RUNNING.value,
-                    spot_table.c.start_at: start_time,
-                    spot_table.c.last_recovered_at: start_time,
-                }))
+    async with _async_write_session() as session:
+        result = await session.execute(_SET_STARTED_STMT, {
+            'b_job_id': job_id,
+            'b_task_id': task_id,
+            'b_start_time': start_time,
+        })
         count = result.rowcount
         await session.commit()
         if count != 1:
@@ -2046,6 +2464,29 @@ async def get_job_status_with_task_id_async(
         return ManagedJobStatus(status[0]) if status else None
 
 
+def _build_set_recovering_stmt(status_condition):
+    current_time = sqlalchemy.bindparam('b_current_time')
+    return sqlalchemy.update(spot_table).where(
+        _task_transition_condition(status_condition)).values({
+            spot_table.c.status: ManagedJobStatus.RECOVERING.value,
+            spot_table.c.job_duration: sqlalchemy.case(
+                (spot_table.c.last_recovered_at >= 0,
+                 spot_table.c.job_duration + current_time -
+                 spot_table.c.last_recovered_at),
+                else_=spot_table.c.job_duration),
+            spot_table.c.last_recovered_at: sqlalchemy.case(
+                (spot_table.c.last_recovered_at < 0, current_time),
+                else_=spot_table.c.last_recovered_at),
+        })
+
+
+_SET_RECOVERING_STMT = _build_set_recovering_stmt(
+    spot_table.c.status == ManagedJobStatus.RUNNING.value)
+
+_FORCE_SET_RECOVERING_STMT = _build_set_recovering_stmt(
+    _task_status_in(ManagedJobStatus.processing_statuses()))
+
+
 @_init_db_async
 async def set_recovering_async(job_id: int, task_id: int,
                                force_transit_to_recovering: bool,
@@ -2055,32 +2496,14 @@ async def set_recovering_async(job_id: int, task_id: int,
     logger.info('=== Recovering... ===')
     current_time = time.time()
 
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        if force_transit_to_recovering:
-            status_condition = spot_table.c.status.in_(
-                [s.value for s in ManagedJobStatus.processing_statuses()])
-        else:
-            status_condition = (
-                spot_table.c.status == ManagedJobStatus.RUNNING.value)
-
+    async with _async_write_session() as session:
         result = await session.execute(
-            sqlalchemy.update(spot_table).where(
-                sqlalchemy.and_(
-                    spot_table.c.spot_job_id == job_id,
-                    spot_table.c.task_id == task_id,
-                    status_condition,
-                    spot_table.c.end_at.is_(None),
-                )).values({
-                    spot_table.c.status: ManagedJobStatus.RECOVERING.value,
-                    spot_table.c.job_duration: sqlalchemy.case(
-                        (spot_table.c.last_recovered_at >= 0,
-                         spot_table.c.job_duration + current_time -
-                         spot_table.c.last_recovered_at),
-                        else_=spot_table.c.job_duration),
-                    spot_table.c.last_recovered_at: sqlalchemy.case(
-                        (spot_table.c.last_recovered_at < 0, current_time),
-                        else_=spot_table.c.last_recovered_at),
-                }))
+            _FORCE_SET_RECOVERING_STMT
+            if force_transit_to_recovering else _SET_RECOVERING_STMT, {
+                'b_job_id': job_id,
+                'b_task_id': task_id,
+                'b_current_time': current_time,
+            })
         count = result.rowcount
         await session.commit()
         if count != 1:
@@ -2095,25 +2518,28 @@ async def set_recovering_async(job_id: int, task_id: int,
     await callback_func('RECOVERING')
 
 
+_SET_RECOVERED_STMT = sqlalchemy.update(spot_table).where(
+    _task_transition_condition(
+        spot_table.c.status == ManagedJobStatus.RECOVERING.value)).values({
+            spot_table.c.status: ManagedJobStatus.RUNNING.value,
+            spot_table.c.last_recovered_at:
+                sqlalchemy.bindparam('b_recovered_time'),
+            spot_table.c.recovery_count: spot_table.c.recovery_count + 1,
+        })
+
+
 @_init_db_async
 async def set_recovered_async(job_id: int, task_id: int, recovered_time: float,
                               callback_func: AsyncCallbackType):
     """Set the task to recovered."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         result = await session.execute(
-            sqlalchemy.update(spot_table).where(
-                sqlalchemy.and_(
-                    spot_table.c.spot_job_id == job_id,
-                    spot_table.c.task_id == task_id,
-                    spot_table.c.status == ManagedJobStatus.RECOVERING.value,
-                    spot_table.c.end_at.is_(None),
-                )).values({
-                    spot_table.c.status: ManagedJobStatus.RUNNING.value,
-                    spot_table.c.last_recovered_at: recovered_time,
-                    spot_table.c.recovery_count: spot_table.c.recovery_count +
-                                                 1,
-                }))
+            _SET_RECOVERED_STMT, {
+                'b_job_id': job_id,
+                'b_task_id': task_id,
+                'b_recovered_time': recovered_time,
+            })
         count = result.rowcount
         await session.commit()
         if count != 1:
@@ -2127,23 +2553,25 @@ async def set_recovered_async(job_id: int, task_id: int, recovered_time: float,
     await callback_func('RECOVERED')
 
 
+_SET_SUCCEEDED_STMT = sqlalchemy.update(spot_table).where(
+    _task_transition_condition(
+        spot_table.c.status == ManagedJobStatus.RUNNING.value)).values({
+            spot_table.c.status: ManagedJobStatus.SUCCEEDED.value,
+            spot_table.c.end_at: sqlalchemy.bindparam('b_end_time'),
+        })
+
+
 @_init_db_async
 async def set_succeeded_async(job_id: int, task_id: int, end_time: float,
                               callback_func: AsyncCallbackType):
     """Set the task to succeeded, if it is in a non-terminal state."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.update(spot_table).where(
-                sqlalchemy.and_(
-                    spot_table.c.spot_job_id == job_id,
-                    spot_table.c.task_id == task_id,
-                    spot_table.c.status == ManagedJobStatus.RUNNING.value,
-                    spot_table.c.end_at.is_(None),
-                )).values({
-                    spot_table.c.status: ManagedJobStatus.SUCCEEDED.value,
-                    spot_table.c.end_at: end_time,
-                }))
+    async with _async_write_session() as session:
+        result = await session.execute(_SET_SUCCEEDED_STMT, {
+            'b_job_id': job_id,
+            'b_task_id': task_id,
+            'b_end_time': end_time,
+        })
         count = result.rowcount
         await session.commit()
         if count != 1:
@@ -2172,39 +2600,14 @@ async def set_failed_async(
     assert failure_type.is_failed(), failure_type
     end_time = time.time() if end_time is None else end_time
 
-    fields_to_set: Dict[str, Any] = {
-        spot_table.c.status: failure_type.value,
-        spot_table.c.failure_reason: failure_reason,
-    }
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        # Get previous status
-        result = await session.execute(
-            sqlalchemy.select(
-                spot_table.c.status).where(spot_table.c.spot_job_id == job_id))
-        previous_status_row = result.fetchone()
-        previous_status = ManagedJobStatus(previous_status_row[0])
-        if previous_status == ManagedJobStatus.RECOVERING:
-            fields_to_set[spot_table.c.last_recovered_at] = end_time
+    fields_to_set = _get_set_failed_fields(failure_type, failure_reason,
+                                           end_time, override_terminal)
+    async with _async_write_session() as session:
         where_conditions = [spot_table.c.spot_job_id == job_id]
         if task_id is not None:
             where_conditions.append(spot_table.c.task_id == task_id)
 
-        # Handle failure_reason prepending when override_terminal is True
-        if override_terminal:
-            # Get existing failure_reason with row lock to prevent race
-            # conditions
-            existing_reason_result = await session.execute(
-                sqlalchemy.select(spot_table.c.failure_reason).where(
-                    sqlalchemy.and_(*where_conditions)).with_for_update())
-            existing_reason_row = existing_reason_result.fetchone()
-            if existing_reason_row and existing_reason_row[0]:
-                # Prepend new failure reason to existing one
-                fields_to_set[spot_table.c.failure_reason] = (
-                    failure_reason + '. Previously: ' + existing_reason_row[0])
-            fields_to_set[spot_table.c.end_at] = sqlalchemy.func.coalesce(
-                spot_table.c.end_at, end_time)
-        else:
-            fields_to_set[spot_table.c.end_at] = end_time
+        if not override_terminal:
             where_conditions.append(spot_table.c.end_at.is_(None))
         result = await session.execute(
             sqlalchemy.update(spot_table).where(
@@ -2222,7 +2625,7 @@ async def set_cancelling_async(job_id: int, callback_func: AsyncCallbackType):
     """Set tasks in the job as cancelling, if they are in non-terminal
     states."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         result = await session.execute(
             sqlalchemy.update(spot_table).where(
                 sqlalchemy.and_(
@@ -2244,7 +2647,7 @@ async def set_cancelling_async(job_id: int, callback_func: AsyncCallbackType):
 async def set_cancelled_async(job_id: int, callback_func: AsyncCallbackType):
     """Set tasks in the job as cancelled, if they are in CANCELLING state."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         result = await session.execute(
             sqlalchemy.update(spot_table).where(
                 sqlalchemy.and_(
@@ -2268,7 +2671,7 @@ async def set_cancelled_async(job_id: int, callback_func: AsyncCallbackType):
 async def remove_ha_recovery_script_async(job_id: int) -> None:
     """Remove the HA recovery script for a job."""
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
+    async with _async_write_session() as session:
         await session.execute(
             sqlalchemy.delete(ha_recovery_script_table).where(
                 ha_recovery_script_table.c.job_id == job_id))
@@ -2284,9 +2687,8 @@ async def get_status_async(job_id: int) -> Optional[ManagedJobStatus]:
 async def get_job_schedule_state_async(job_id: int) -> ManagedJobScheduleState:
     assert _SQLALCHEMY_ENGINE_ASYNC is not None
     async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.select(job_info_table.c.schedule_state).where(
-                job_info_table.c.spot_job_id == job_id))
+        result = await session.execute(_GET_SCHEDULE_STATE_STMT,
+                                       {'b_job_id': job_id})
         state = result.fetchone()[0]
         return ManagedJobScheduleState(state)
 
@@ -2295,22 +2697,10 @@ async def get_job_schedule_state_async(job_id: int) -> ManagedJobScheduleState:
 async def scheduler_set_done_async(job_id: int,
                                    idempotent: bool = False) -> None:
     """Do not call without holding the scheduler lock."""
-    assert _SQLALCHEMY_ENGINE_ASYNC is not None
-    async with sql_async.AsyncSession(_SQLALCHEMY_ENGINE_ASYNC) as session:
-        result = await session.execute(
-            sqlalchemy.update(job_info_table).where(
-                sqlalchemy.and_(
-                    job_info_table.c.spot_job_id == job_id,
-                    job_info_table.c.schedule_state !=
-                    ManagedJobScheduleState.DONE.value,
-                )).values({
-                    job_info_table.c.schedule_state:
-                        ManagedJobScheduleState.DONE.value
-                }))
-        updated_count = result.rowcount
-        await session.commit()
-        if not idempotent:
-            assert updated_count == 1, (job_id, updated_count)
+    updated_count = await _transition_schedule_state_async(
+        _SCHEDULER_SET_DONE_STMT, job_id)
+    if not idempotent:
+        assert updated_count == 1, (job_id, updated_count)
 
 
 # ==== needed for codegen ====
@@ -2387,30 +2777,23 @@ def reset_job_for_recovery(job_id: int) -> None:
         session.commit()
 
 
+_GET_ALL_JOB_IDS_STMT = _job_ids_stmt()
+
+_GET_ALL_JOB_IDS_BY_NAME_STMT = _job_ids_stmt(_JOB_NAME_MATCHES)
+
+
 @_init_db
 def get_all_job_ids_by_name(name: Optional[str]) -> List[int]:
     """Get all job ids by name."""
     assert _SQLALCHEMY_ENGINE is not None
 
     with orm.Session(_SQLALCHEMY_ENGINE) as session:
-        query = sqlalchemy.select(
-            spot_table.c.spot_job_id.distinct()).select_from(
-                spot_table.outerjoin(
-                    job_info_table,
-                    spot_table.c.spot_job_id == job_info_table.c.spot_job_id))
-        if name is not None:
-            # We match the job name from `job_info` for the jobs submitted after
-            # #1982, and from `spot` for the jobs submitted before #1982, whose
-            # job_info is not available.
-            name_condition = sqlalchemy.or_(
-                job_info_table.c.name == name,
-                sqlalchemy.and_(job_info_table.c.name.is_(None),
-                                spot_table.c.task_name == name))
-            query = query.where(name_condition)
-        query = query.order_by(spot_table.c.spot_job_id.desc())
-        rows = session.execute(query).fetchall()
-        job_ids = [row[0] for row in rows if row[0] is not None]
-        return job_ids
+        if name is None:
+            result = session.execute(_GET_ALL_JOB_IDS_STMT)
+        else:
+            result = session.execute(_GET_ALL_JOB_IDS_BY_NAME_STMT,
+                                     {'b_name': name})
+        return [row[0] for row in result if row[0] is not None]
 
 
 @_init_db
@@ -488,6 +488,14 @@ def controller_process_alive(record: managed_job_state.ControllerPidRecord,
         return False
 
 
+# The task fields used by update_managed_jobs_statuses, so that it does not
+# read the YAML and file contents of every job it checks.
+_CLEANUP_JOB_CLUSTERS_FIELDS = ['pool', 'job_name', 'task_name']
+_CHECK_JOB_STATUS_FIELDS = [
+    'status', 'schedule_state', 'controller_pid', 'controller_pid_started_at'
+]
+
+
 def update_managed_jobs_statuses(job_id: Optional[int] = None):
     """Update managed job status if the controller process failed abnormally.
 
@@ -519,7 +527,8 @@ def update_managed_jobs_statuses(job_id: Optional[int] = None):
         capture the error message, and log/return it.
         """
         error_msg = None
-        tasks = managed_job_state.get_managed_job_tasks(job_id)
+        tasks = managed_job_state.get_managed_job_tasks(
+            job_id, fields=_CLEANUP_JOB_CLUSTERS_FIELDS)
         for task in tasks:
             pool = task.get('pool', None)
             if pool is None:
@@ -551,7 +560,8 @@ def update_managed_jobs_statuses(job_id: Optional[int] = None):
 
     for job_id in job_ids:
         assert job_id is not None
-        tasks = managed_job_state.get_managed_job_tasks(job_id)
+        tasks = managed_job_state.get_managed_job_tasks(
+            job_id, fields=_CHECK_JOB_STATUS_FIELDS)
         # Note: controller_pid and schedule_state are in the job_info table
         # which is joined to the spot table, so all tasks with the same job_id
         # will have the same value for these columns. This is what lets us just
@@ -784,6 +794,10 @@ def event_callback_func(
         logger.info(f'=== END: event callback for {status!r} ===')
 
     async def async_callback_func(status: str):
+        # Most tasks have no event callback. Skip the thread hop for them, as
+        # this is called on every status transition of the task.
+        if task is None or task.event_callback is None:
+            return
         return await context_utils.to_thread(callback_func, status)
 
     return async_callback_func
@@ -0,0 +1,42 @@
+"""Add indexes for task status transitions and scheduler lookups.
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-14
+
+"""
+# pylint: disable=invalid-name
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from sky.utils.db import db_utils
+
+# revision identifiers, used by Alembic.
+revision: str = '008'
+down_revision: Union[str, Sequence[str], None] = '007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade():
+    """Add indexes on spot and job_info, and refresh planner statistics."""
+    with op.get_context().autocommit_block():
+        db_utils.add_index_to_table_alembic('spot', 'idx_spot_job_task',
+                                            ['spot_job_id', 'task_id'])
+        # idx_spot_job_task also serves the lookups by spot_job_id alone, so
+        # the single column index created from `index=True` is dropped.
+        db_utils.drop_index_from_table_alembic('spot', 'ix_spot_spot_job_id')
+        db_utils.add_index_to_table_alembic(
+            'job_info', 'idx_job_info_waiting',
+            ['schedule_state',
+             sa.text('priority DESC'), 'spot_job_id', 'pool'])
+        # Let the query planner pick up the new indexes.
+        op.execute(sa.text('ANALYZE spot'))
+        op.execute(sa.text('ANALYZE job_info'))
+
+
+def downgrade():
+    """No downgrade logic."""
+    pass
@@ -229,10 +229,10 @@ class JobsServiceImpl(jobsv1_pb2_grpc.JobsServiceServicer):
                 # job template (jobs-controller.yaml.j2), as it may need
                 # to wait for the run commands to be scheduled on the job
                 # controller in high-load cases.
-                for task in managed_job.tasks:
-                    managed_job_state.set_pending(job_id, task.task_id,
-                                                  task.name, task.resources_str,
-                                                  task.metadata_json)
+                managed_job_state.set_pending_many(
+                    job_id, [(task.task_id, task.name, task.resources_str,
+                              task.metadata_json)
+                             for task in managed_job.tasks])
             return jobsv1_pb2.QueueJobResponse()
         except Exception as e:  # pylint: disable=broad-except
             context.abort(grpc.StatusCode.INTERNAL, str(e))
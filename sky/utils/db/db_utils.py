@@ -7,7 +7,8 @@ import pathlib
 import sqlite3
 import threading
 import typing
-from typing import Any, Callable, Dict, Iterable, Literal, Optional, Union
+from typing import (Any, Callable, Dict, Iterable, List, Literal, Optional,
+                    Union)
 
 import aiosqlite
 import aiosqlite.context
@@ -255,6 +256,54 @@ def add_column_to_table_alembic(
             raise
 
 
+def add_index_to_table_alembic(
+    table_name: str,
+    index_name: str,
+    columns: List[Union[str, sqlalchemy.TextClause]],
+):
+    """Add an index to a table using Alembic operations.
+
+    Args:
+        table_name: Name of the table to add the index to.
+        index_name: Name of the new index.
+        columns: Names of the indexed columns, or text expressions such as
+            `sqlalchemy.text('priority DESC')` for descending columns.
+    """
+    from alembic import op  # pylint: disable=import-outside-toplevel
+
+    try:
+        op.create_index(index_name, table_name, columns)
+    except (sqlalchemy_exc.ProgrammingError,
+            sqlalchemy_exc.OperationalError) as e:
+        if 'already exists' in str(e).lower():
+            pass  # Index already exists, that's fine
+        else:
+            raise
+
+
+def drop_index_from_table_alembic(
+    table_name: str,
+    index_name: str,
+):
+    """Drop an index from a table using Alembic operations.
+
+    Args:
+        table_name: Name of the table the index is on.
+        index_name: Name of the index to drop.
+    """
+    from alembic import op  # pylint: disable=import-outside-toplevel
+
+    try:
+        op.drop_index(index_name, table_name=table_name)
+    except (sqlalchemy_exc.ProgrammingError,
+            sqlalchemy_exc.OperationalError) as e:
+        if ('no such index' in str(e).lower() or
+                'does not exist' in str(e).lower()):
+            pass  # Already dropped
+        else:
+            raise
+
+
 def drop_column_from_table_alembic(
     table_name: str,
     column_name: str,
@@ -472,7 +521,10 @@ def get_engine(
     else:
         assert db_name is not None, 'db_name must be provided for SQLite'
         db_path = runtime_utils.get_runtime_dir_path(f'.sky/{db_name}.db')
-        pathlib.Path(db_path).parents[0].mkdir(parents=True, exist_ok=True)
+        # The directory already exists if we have created a sync engine for
+        # this database before, so skip the mkdir for repeated calls.
+        if db_path not in _sqlite_engine_cache:
+            pathlib.Path(db_path).parents[0].mkdir(parents=True, exist_ok=True)
         if async_engine:
             # This is an AsyncEngine, instead of a (normal, synchronous) Engine,
             # so we should not put it in the cache. Instead, just return.
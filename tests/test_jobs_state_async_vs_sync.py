@@ -539,3 +539,270 @@ async def test_transition_failures_surface_details_for_all_functions(
         job_id, missing_task_id, time.time(), noop_callback))
     await expect_failure(lambda: state.set_succeeded_async(
         job_id, missing_task_id, time.time(), noop_callback))
+
+
+@pytest.mark.asyncio
+async def test_task_lifecycle_transitions(_seed_one_job: int):
+    """Walk a task through the full set of hot-path status transitions."""
+    job_id = _seed_one_job
+    events: List[str] = []
+
+    async def record_callback(event: str):
+        events.append(event)
+
+    await state.set_starting_async(job_id, 0, 'run-id', 100.0, 'res',
+                                   {'max_restarts_on_errors': 1},
+                                   record_callback)
+    assert state.get_task_specs(job_id, 0) == {'max_restarts_on_errors': 1}
+    await state.set_started_async(job_id, 0, 200.0, record_callback)
+    await state.set_recovering_async(job_id, 0, False, record_callback)
+    assert state.get_status(job_id) == state.ManagedJobStatus.RECOVERING
+    await state.set_recovered_async(job_id, 0, 300.0, record_callback)
+    # Force transition is allowed from any processing status.
+    await state.set_recovering_async(job_id, 0, True, record_callback)
+    await state.set_recovered_async(job_id, 0, 400.0, record_callback)
+    await state.set_succeeded_async(job_id, 0, 500.0, record_callback)
+
+    assert events == [
+        'SUBMITTED', 'STARTING', 'STARTED', 'RECOVERING', 'RECOVERED',
+        'RECOVERING', 'RECOVERED', 'SUCCEEDED'
+    ]
+    [task] = state.get_managed_job_tasks(job_id)
+    assert task['status'] == state.ManagedJobStatus.SUCCEEDED
+    assert task['resources'] == 'res'
+    assert task['run_timestamp'] == 'run-id'
+    assert task['submitted_at'] == 100.0
+    assert task['start_at'] == 200.0
+    assert task['last_recovered_at'] == 400.0
+    assert task['recovery_count'] == 2
+    assert task['end_at'] == 500.0
+    assert task['job_duration'] > 0
+
+
+@pytest.mark.asyncio
+async def test_set_failed_updates_last_recovered_at_per_task(
+        _seed_complex_job: int):
+    """Only tasks that were RECOVERING get last_recovered_at reset."""
+    job_id = _seed_complex_job
+    _set_statuses(
+        job_id, {
+            0: state.ManagedJobStatus.RUNNING,
+            2: state.ManagedJobStatus.RECOVERING,
+            5: state.ManagedJobStatus.PENDING,
+        })
+
+    state.set_failed(job_id,
+                     task_id=2,
+                     failure_type=state.ManagedJobStatus.FAILED_CONTROLLER,
+                     failure_reason='sync failure',
+                     end_time=123.0)
+    await state.set_failed_async(
+        job_id,
+        task_id=None,
+        failure_type=state.ManagedJobStatus.FAILED_CONTROLLER,
+        failure_reason='async failure',
+        end_time=456.0)
+
+    tasks = {t['task_id']: t for t in state.get_managed_job_tasks(job_id)}
+    assert tasks[2]['last_recovered_at'] == 123.0
+    assert tasks[2]['end_at'] == 123.0
+    assert tasks[2]['failure_reason'] == 'sync failure'
+    for task_id in (0, 5):
+        assert tasks[task_id]['last_recovered_at'] == -1
+        assert tasks[task_id]['end_at'] == 456.0
+        assert tasks[task_id]['failure_reason'] == 'async failure'
+        assert (tasks[task_id]['status'] ==
+                state.ManagedJobStatus.FAILED_CONTROLLER)
+
+    # Failing a job that does not exist is a no-op.
+    state.set_failed(9999,
+                     task_id=None,
+                     failure_type=state.ManagedJobStatus.FAILED,
+                     failure_reason='missing')
+    await state.set_failed_async(9999,
+                                 task_id=None,
+                                 failure_type=state.ManagedJobStatus.FAILED,
+                                 failure_reason='missing')
+
+
+@pytest.mark.asyncio
+async def test_init_db_async_retries_on_db_errors(_mock_jobs_db_conn,
+                                                  monkeypatch):
+
+    async def _no_sleep(_):
+        pass
+
+    monkeypatch.setattr(state.asyncio, 'sleep', _no_sleep)
+    calls = []
+
+    @state._init_db_async
+    async def _flaky(fail_times: int):
+        calls.append(fail_times)
+        if len(calls) <= fail_times:
+            raise state.sqlalchemy_exc.TimeoutError()
+        return 'ok'
+
+    assert await _flaky(1) == 'ok'
+    assert len(calls) == 2
+
+    calls.clear()
+    with pytest.raises(state.sqlalchemy_exc.TimeoutError):
+        await _flaky(state._DB_RETRY_TIMES)
+    assert len(calls) == state._DB_RETRY_TIMES
+
+
+@pytest.mark.asyncio
+async def test_concurrent_async_writes_are_serialized(_mock_jobs_db_conn,
+                                                      monkeypatch):
+    job_ids = [
+        state.set_job_info_without_job_id(name=f'job-{i}',
+                                          workspace='default',
+                                          entrypoint='echo',
+                                          pool=None,
+                                          pool_hash=None,
+                                          user_hash='abcd1234')
+        for i in range(10)
+    ]
+    active = 0
+    max_active = 0
+    session_cls = state.sql_async.AsyncSession
+
+    class _TrackingSession(session_cls):
+
+        async def __aenter__(self):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            # Yield to the event loop so that other writers get a chance to
+            # run concurrently if they are not serialized.
+            await asyncio.sleep(0)
+            return await super().__aenter__()
+
+        async def __aexit__(self, *args):
+            nonlocal active
+            active -= 1
+            return await super().__aexit__(*args)
+
+    monkeypatch.setattr(state.sql_async, 'AsyncSession', _TrackingSession)
+    await asyncio.gather(
+        *(state.scheduler_set_launching_async(job_id) for job_id in job_ids))
+    assert max_active == 1
+    for job_id in job_ids:
+        assert (state.get_job_schedule_state(job_id) ==
+                state.ManagedJobScheduleState.LAUNCHING)
+
+
+@pytest.mark.asyncio
+async def test_async_engine_sets_sqlite_pragmas(_mock_jobs_db_conn, tmp_path,
+                                                monkeypatch):
+    async_engine = create_async_engine(
+        f'sqlite+aiosqlite:///{tmp_path / "jobs_state_testing.db"}')
+    monkeypatch.setattr(state, '_SQLALCHEMY_ENGINE_ASYNC', None)
+    monkeypatch.setattr(state.db_utils, 'get_engine',
+                        lambda *args, **kwargs: async_engine)
+    assert state.initialize_and_get_db_async() is async_engine
+    async with async_engine.connect() as conn:
+        result = await conn.exec_driver_sql('PRAGMA busy_timeout')
+        assert result.scalar() == 10000
+        result = await conn.exec_driver_sql('PRAGMA synchronous')
+        assert result.scalar() == 1
+    await async_engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_async_engine_keeps_longer_busy_timeout(_mock_jobs_db_conn,
+                                                      tmp_path, monkeypatch):
+    monkeypatch.delenv(sky_constants.ENV_VAR_IS_SKYPILOT_SERVER, raising=False)
+    monkeypatch.setattr(state.db_utils.runtime_utils, 'get_runtime_dir_path',
+                        lambda _path: str(tmp_path / 'jobs_state_testing.db'))
+    monkeypatch.setattr(state, '_SQLALCHEMY_ENGINE_ASYNC', None)
+    async_engine = state.initialize_and_get_db_async()
+    async with async_engine.connect() as conn:
+        # The 30s lock timeout from db_utils.get_engine is not lowered.
+        result = await conn.exec_driver_sql('PRAGMA busy_timeout')
+        assert result.scalar() == 30000
+        result = await conn.exec_driver_sql('PRAGMA synchronous')
+        assert result.scalar() == 1
+    await async_engine.dispose()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('update_returning', [True, False])
+async def test_get_waiting_job_async_picks_highest_priority(
+        _mock_jobs_db_conn, monkeypatch, update_returning):
+    monkeypatch.setattr(state._SQLALCHEMY_ENGINE_ASYNC.dialect,
+                        'update_returning', update_returning)
+    job_ids = []
+    for priority, pool in [(100, None), (500, 'pool-a'), (500, None)]:
+        job_id = state.set_job_info_without_job_id(name='job',
+                                                   workspace='default',
+                                                   entrypoint='echo',
+                                                   pool=pool,
+                                                   pool_hash=None,
+                                                   user_hash='abcd1234')
+        state.scheduler_set_waiting(job_id, 'dag', 'user', 'env', None,
+                                    priority)
+        job_ids.append(job_id)
+
+    expected = [(job_ids[1], 'pool-a'), (job_ids[2], None), (job_ids[0], None)]
+    for job_id, pool in expected:
+        job = await state.get_waiting_job_async(pid=1234, pid_started_at=1.5)
+        assert job == {'job_id': job_id, 'pool': pool}
+        assert (state.get_job_schedule_state(job_id) ==
+                state.ManagedJobScheduleState.LAUNCHING)
+        assert state.get_job_controller_process(
+            job_id) == state.ControllerPidRecord(pid=1234, started_at=1.5)
+    assert await state.get_waiting_job_async(pid=1234,
+                                             pid_started_at=1.5) is None
+
+
+@pytest.mark.asyncio
+async def test_immediate_write_session_takes_write_lock(_mock_jobs_db_conn,
+                                                        tmp_path):
+    import sqlite3
+    job_id = state.set_job_info_without_job_id(name='job',
+                                               workspace='default',
+                                               entrypoint='echo',
+                                               pool=None,
+                                               pool_hash=None,
+                                               user_hash='abcd1234')
+    other = sqlite3.connect(tmp_path / 'jobs_state_testing.db', timeout=0)
+    try:
+        async with state._async_write_session(immediate=True) as session:
+            # The write lock is held before this transaction writes anything.
+            with pytest.raises(sqlite3.OperationalError, match='locked'):
+                other.execute('UPDATE job_info SET priority = 1')
+            await session.execute(
+                state.sqlalchemy.update(state.job_info_table).values(priority=2)
+            )
+            await session.commit()
+        other.execute('UPDATE job_info SET priority = priority + 1')
+        other.commit()
+    finally:
+        other.close()
+    async with state._async_write_session(immediate=True) as session:
+        result = await session.execute(
+            state.sqlalchemy.select(state.job_info_table.c.priority).where(
+                state.job_info_table.c.spot_job_id == job_id))
+        assert result.scalar() == 3
+
+
+@pytest.mark.asyncio
+async def test_scheduler_set_alive_async_requires_launching(_mock_jobs_db_conn):
+    job_id = state.set_job_info_without_job_id(name='job',
+                                               workspace='default',
+                                               entrypoint='echo',
+                                               pool=None,
+                                               pool_hash=None,
+                                               user_hash='abcd1234')
+    with pytest.raises(AssertionError):
+        await state.scheduler_set_alive_async(job_id)
+    assert (state.get_job_schedule_state(job_id) ==
+            state.ManagedJobScheduleState.INACTIVE)
+
+    await state.scheduler_set_launching_async(job_id)
+    await state.scheduler_set_alive_async(job_id)
+    assert (state.get_job_schedule_state(job_id) ==
+            state.ManagedJobScheduleState.ALIVE)
+    with pytest.raises(AssertionError):
+        await state.scheduler_set_alive_async(job_id)
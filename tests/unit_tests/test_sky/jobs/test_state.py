@@ -9,6 +9,7 @@ from sqlalchemy import create_engine
 from sqlalchemy import orm
 from sqlalchemy.ext.asyncio import create_async_engine
 
+from sky.jobs import scheduler
 from sky.jobs import state
 from sky.jobs.state import ManagedJobStatus
 
@@ -349,3 +350,557 @@ def test_set_controller_logs_cleaned(_mock_managed_jobs_db_conn):
                     state.job_info_table.c.spot_job_id == job_id)).fetchone()
         assert row is not None
         assert row[0] == now
+
+
+def test_set_pending_many(_mock_managed_jobs_db_conn):
+    job_id = _insert_job_info(state._SQLALCHEMY_ENGINE)
+
+    state.set_pending_many(job_id, [
+        (0, 'task-0', 'res-0', '{}'),
+        (1, 'task-1', 'res-1', '{"k": "v"}'),
+    ])
+
+    assert state.get_all_task_ids_names_statuses_logs(job_id) == [
+        (0, 'task-0', ManagedJobStatus.PENDING, None, None),
+        (1, 'task-1', ManagedJobStatus.PENDING, None, None),
+    ]
+    # An empty batch is a no-op.
+    state.set_pending_many(job_id, [])
+    assert state.get_num_tasks(job_id) == 2
+
+
+def test_set_pending_is_idempotent(_mock_managed_jobs_db_conn):
+    job_id = _insert_job_info(state._SQLALCHEMY_ENGINE)
+    state.set_pending(job_id, 0, 'task-0', 'res-0', '{}')
+    # Retrying the submission does not add duplicate task rows, or reset a
+    # task that has already moved on.
+    set_running = state.sqlalchemy.update(
+        state.spot_table).values(status=ManagedJobStatus.RUNNING.value)
+    with orm.Session(state._SQLALCHEMY_ENGINE) as session:
+        session.execute(set_running)
+        session.commit()
+    state.set_pending(job_id, 0, 'task-0', 'res-0', '{}')
+    state.set_pending_many(job_id, [
+        (0, 'task-0', 'res-0', '{}'),
+        (1, 'task-1', 'res-1', '{}'),
+    ])
+    assert state.get_all_task_ids_names_statuses_logs(job_id) == [
+        (0, 'task-0', ManagedJobStatus.RUNNING, None, None),
+        (1, 'task-1', ManagedJobStatus.PENDING, None, None),
+    ]
+
+
+def test_create_table_sets_sqlite_pragmas(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    # Calling create_table again must not register the listener twice.
+    state.create_table(engine)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+        assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 10000
+        assert conn.exec_driver_sql('PRAGMA temp_store').scalar() == 2
+        assert conn.exec_driver_sql('PRAGMA cache_size').scalar() == -20000
+        assert conn.exec_driver_sql(
+            'PRAGMA wal_autocheckpoint').scalar() == 1000
+
+
+def test_start_db_maintenance_thread(_mock_managed_jobs_db_conn, monkeypatch):
+    engine = _mock_managed_jobs_db_conn
+    ran = state.threading.Event()
+    at_exit = []
+    monkeypatch.setattr(state, '_DB_MAINTENANCE_THREAD', None)
+    monkeypatch.setattr(state, '_db_maintenance_loop',
+                        lambda _engine: ran.set())
+    monkeypatch.setattr(state.atexit, 'register',
+                        lambda *args: at_exit.append(args))
+
+    state.start_db_maintenance_thread()
+    thread = state._DB_MAINTENANCE_THREAD
+    assert thread is not None and thread.daemon
+    assert ran.wait(timeout=10)
+    assert at_exit == [(state._optimize_sqlite_db, engine)]
+    # A second call does not start another thread.
+    state.start_db_maintenance_thread()
+    assert state._DB_MAINTENANCE_THREAD is thread
+    assert len(at_exit) == 1
+    # Connections opened afterwards leave checkpointing to the thread.
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA wal_autocheckpoint').scalar() == 0
+        assert conn.exec_driver_sql('PRAGMA analysis_limit').scalar() == 1000
+    state._optimize_sqlite_db(engine)
+
+
+def test_db_maintenance_loop_optimizes_periodically(_mock_managed_jobs_db_conn,
+                                                    monkeypatch):
+    engine = _mock_managed_jobs_db_conn
+    optimized = []
+    sleeps = 0
+
+    def _sleep(_seconds):
+        nonlocal sleeps
+        sleeps += 1
+        if sleeps > 3:
+            raise StopIteration
+
+    monkeypatch.setattr(state.time, 'sleep', _sleep)
+    monkeypatch.setattr(state, '_OPTIMIZE_INTERVAL_SECONDS', 0)
+    monkeypatch.setattr(state, '_optimize_sqlite_db', optimized.append)
+    with pytest.raises(StopIteration):
+        state._db_maintenance_loop(engine)
+    assert optimized == [engine] * 3
+
+
+def test_db_maintenance_loop_survives_unexpected_errors(
+        _mock_managed_jobs_db_conn, monkeypatch):
+    engine = _mock_managed_jobs_db_conn
+    sleeps = 0
+    optimize_calls = 0
+
+    def _sleep(_seconds):
+        nonlocal sleeps
+        sleeps += 1
+        if sleeps > 3:
+            raise StopIteration
+
+    def _connect():
+        raise state.sqlalchemy_exc.ProgrammingError('PRAGMA', {}, None)
+
+    def _optimize(_engine):
+        nonlocal optimize_calls
+        optimize_calls += 1
+        raise RuntimeError('optimize failed')
+
+    monkeypatch.setattr(state.time, 'sleep', _sleep)
+    monkeypatch.setattr(engine, 'connect', _connect)
+    monkeypatch.setattr(state, '_OPTIMIZE_INTERVAL_SECONDS', 0)
+    monkeypatch.setattr(state, '_optimize_sqlite_db', _optimize)
+    with pytest.raises(StopIteration):
+        state._db_maintenance_loop(engine)
+    # Each failed checkpoint and optimize is logged, and the loop goes on.
+    assert sleeps == 4
+    assert optimize_calls == 3
+
+
+def test_state_calls_reuse_pooled_connection(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    _insert_task(engine, job_id, 0, status=ManagedJobStatus.PENDING)
+
+    connects = []
+    state.sqlalchemy.event.listen(engine, 'connect',
+                                  lambda *args: connects.append(args))
+    for _ in range(10):
+        assert state.get_status(job_id) == ManagedJobStatus.PENDING
+        assert state.get_job_schedule_state(
+            job_id) == state.ManagedJobScheduleState.INACTIVE
+    # All calls are served by the connection already in the engine's pool.
+    assert not connects
+
+
+def _get_index_names(engine, table_name: str):
+    # Query sqlite_master rather than using PRAGMA index_list, which may return
+    # a stale schema on a pooled connection after a migration.
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            'SELECT name FROM sqlite_master '
+            'WHERE type = \'index\' AND tbl_name = ?',
+            (table_name,)).fetchall()
+    return {row[0] for row in rows}
+
+
+def test_status_transition_indexes_migration(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    expected_spot_indexes = {'idx_spot_job_task'}
+    assert _get_index_names(engine, 'spot') == expected_spot_indexes
+    assert 'idx_job_info_waiting' in _get_index_names(engine, 'job_info')
+
+    # Simulate a database created before revision 008.
+    with engine.begin() as conn:
+        conn.exec_driver_sql('DROP INDEX idx_spot_job_task')
+        conn.exec_driver_sql('DROP INDEX idx_job_info_waiting')
+        conn.exec_driver_sql(
+            'CREATE INDEX ix_spot_spot_job_id ON spot (spot_job_id)')
+        conn.exec_driver_sql(
+            'UPDATE alembic_version_spot_jobs_db SET version_num = \'007\'')
+    state.create_table(engine)
+    # The single column index is superseded by idx_spot_job_task.
+    assert _get_index_names(engine, 'spot') == expected_spot_indexes
+    assert _get_index_names(engine, 'job_info') == {'idx_job_info_waiting'}
+
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            'EXPLAIN QUERY PLAN UPDATE spot SET status = \'RUNNING\' '
+            'WHERE spot_job_id = 1 AND task_id = 0 '
+            'AND status = \'STARTING\' AND end_at IS NULL').fetchall()
+        assert any('idx_spot_job_task' in row[-1] for row in plan), plan
+        plan = conn.exec_driver_sql(
+            'EXPLAIN QUERY PLAN SELECT task_name FROM spot '
+            'WHERE spot_job_id = 1 AND task_id = 0').fetchall()
+        assert any('idx_spot_job_task' in row[-1] for row in plan), plan
+        plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(
+            state._GET_WAITING_JOB_STMT.compile(
+                engine, compile_kwargs={'literal_binds': True}))).fetchall()
+    details = [row[-1] for row in plan]
+    # Served from the index alone, without sorting the waiting jobs.
+    assert any('COVERING INDEX idx_job_info_waiting' in detail
+               for detail in details), details
+    assert not any('TEMP B-TREE' in detail for detail in details), details
+
+
+def test_init_db_retries_on_db_errors(_mock_managed_jobs_db_conn, monkeypatch):
+    monkeypatch.setattr(state.time, 'sleep', lambda _: None)
+    calls = []
+
+    @state._init_db
+    def _flaky(fail_times: int):
+        calls.append(fail_times)
+        if len(calls) <= fail_times:
+            raise state.sqlite3.OperationalError('database is locked')
+        return 'ok'
+
+    assert _flaky(0) == 'ok'
+    assert len(calls) == 1
+
+    calls.clear()
+    assert _flaky(2) == 'ok'
+    assert len(calls) == 3
+
+    calls.clear()
+    with pytest.raises(state.sqlite3.OperationalError):
+        _flaky(state._DB_RETRY_TIMES)
+    assert len(calls) == state._DB_RETRY_TIMES
+
+
+def test_initial_migration_adds_missing_columns(tmp_path, monkeypatch):
+    db_path = tmp_path / 'legacy_managed_jobs.db'
+    engine = create_engine(f'sqlite:///{db_path}')
+    # A spot table from before the backwards compatibility columns existed.
+    with engine.begin() as conn:
+        conn.exec_driver_sql("""\
+            CREATE TABLE spot (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_name TEXT,
+            resources TEXT,
+            submitted_at FLOAT,
+            status TEXT,
+            run_timestamp TEXT CANDIDATE KEY,
+            start_at FLOAT DEFAULT NULL,
+            end_at FLOAT DEFAULT NULL,
+            last_recovered_at FLOAT DEFAULT -1,
+            recovery_count INTEGER DEFAULT 0,
+            job_duration FLOAT DEFAULT 0)""")
+        conn.exec_driver_sql(
+            'INSERT INTO spot (job_name, status) VALUES (\'legacy\', '
+            '\'SUCCEEDED\')')
+
+    @contextlib.contextmanager
+    def _tmp_db_lock(_section: str):
+        with filelock.FileLock(str(tmp_path / f'.{_section}.lock'), timeout=10):
+            yield
+
+    monkeypatch.setattr(state.migration_utils, 'db_lock', _tmp_db_lock)
+    state.create_table(engine)
+
+    with engine.connect() as conn:
+        row = conn.exec_driver_sql(
+            'SELECT spot_job_id, task_id, task_name, metadata FROM spot'
+        ).fetchone()
+    assert tuple(row) == (1, 0, 'legacy', '{}')
+
+
+def test_managed_job_status_ordering():
+    statuses = list(ManagedJobStatus)
+    assert sorted(reversed(statuses)) == statuses
+    assert ManagedJobStatus.PENDING < ManagedJobStatus.RUNNING
+    assert not ManagedJobStatus.RUNNING < ManagedJobStatus.RUNNING
+    assert min(statuses[::-1]) == statuses[0]
+
+
+def test_managed_job_status_predicates():
+    terminal = ManagedJobStatus.terminal_statuses()
+    failed = ManagedJobStatus.failure_statuses()
+    for status in ManagedJobStatus:
+        assert status.is_terminal() == (status in terminal)
+        assert status.is_failed() == (status in failed)
+
+
+def test_get_jobs_to_check_status(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    expected = []
+    for schedule_state, status, should_check in [
+        (state.ManagedJobScheduleState.ALIVE, ManagedJobStatus.RUNNING, True),
+        (state.ManagedJobScheduleState.DONE, ManagedJobStatus.SUCCEEDED, False),
+        (state.ManagedJobScheduleState.DONE, ManagedJobStatus.RUNNING, True),
+        (None, ManagedJobStatus.SUCCEEDED, False),
+        (None, ManagedJobStatus.RUNNING, True),
+    ]:
+        job_id = _insert_job_info(engine)
+        with orm.Session(engine) as session:
+            session.execute(
+                state.sqlalchemy.update(state.job_info_table).where(
+                    state.job_info_table.c.spot_job_id == job_id).values(
+                        schedule_state=(
+                            schedule_state.value if schedule_state else None)))
+            session.commit()
+        _insert_task(engine, job_id, 0, status=status)
+        if should_check:
+            expected.append(job_id)
+
+    assert state.get_jobs_to_check_status() == sorted(expected, reverse=True)
+    assert state.get_jobs_to_check_status(expected[0]) == [expected[0]]
+
+
+def test_get_job_ids_by_name(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_ids = []
+    for user_hash, status in [('user-a', ManagedJobStatus.RUNNING),
+                              ('user-b', ManagedJobStatus.SUCCEEDED)]:
+        job_id = _insert_job_info(engine)
+        with orm.Session(engine) as session:
+            session.execute(
+                state.sqlalchemy.update(state.job_info_table).where(
+                    state.job_info_table.c.spot_job_id == job_id).values(
+                        user_hash=user_hash))
+            session.commit()
+        _insert_task(engine, job_id, 0, status=status)
+        job_ids.append(job_id)
+    running_job_id, succeeded_job_id = job_ids
+    # A legacy job without job_info is matched by its task name.
+    legacy_job_id = succeeded_job_id + 1
+    _insert_task(engine, legacy_job_id, 0, status=ManagedJobStatus.RUNNING)
+
+    assert state.get_nonterminal_job_ids_by_name('job') == [running_job_id]
+    assert state.get_nonterminal_job_ids_by_name('task-0') == [legacy_job_id]
+    assert state.get_nonterminal_job_ids_by_name(
+        None, user_hash='user-a') == [running_job_id]
+    assert state.get_nonterminal_job_ids_by_name(None, user_hash='user-b') == []
+    assert state.get_nonterminal_job_ids_by_name(
+        None, all_users=True) == [legacy_job_id, running_job_id]
+    assert state.get_all_job_ids_by_name('job') == [
+        succeeded_job_id, running_job_id
+    ]
+    assert state.get_all_job_ids_by_name(None) == [
+        legacy_job_id, succeeded_job_id, running_job_id
+    ]
+
+
+def test_managed_job_status_colored_str():
+    for status in ManagedJobStatus:
+        color = state._SPOT_STATUS_TO_COLOR[status]
+        assert status.colored_str() == (
+            f'{color}{status.value}{state.colorama.Style.RESET_ALL}')
+
+
+def test_get_managed_jobs_with_filters_projects_fields(
+        _mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    _insert_task(engine, job_id, 0, status=ManagedJobStatus.RUNNING)
+
+    jobs, total = state.get_managed_jobs_with_filters(
+        fields=['job_id', 'status', 'schedule_state'])
+    assert total == 1
+    job = jobs[0]
+    assert set(job) == {name for name, _ in state._JOBS_DICT_COLUMNS
+                       } | {'user_yaml'}
+    assert job['job_id'] == job_id
+    assert job['status'] == ManagedJobStatus.RUNNING
+    assert job['schedule_state'] == state.ManagedJobScheduleState.INACTIVE
+    # Fields that were not selected are None.
+    assert job['resources'] is None
+    assert job['failure_reason'] is None
+
+    full_job = state.get_managed_job_tasks(job_id)[0]
+    assert full_job['job_id'] == job_id
+    assert full_job['task_name'] == 'task-0'
+    assert full_job['job_name'] == 'job'
+
+
+def test_scheduler_counts(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    for schedule_state, pool in [
+        (state.ManagedJobScheduleState.WAITING, None),
+        (state.ManagedJobScheduleState.LAUNCHING, None),
+        (state.ManagedJobScheduleState.LAUNCHING, 'pool-a'),
+        (state.ManagedJobScheduleState.ALIVE, 'pool-a'),
+        (state.ManagedJobScheduleState.ALIVE_BACKOFF, 'pool-b'),
+        (state.ManagedJobScheduleState.DONE, 'pool-a'),
+    ]:
+        job_id = _insert_job_info(engine)
+        with orm.Session(engine) as session:
+            session.execute(
+                state.sqlalchemy.update(state.job_info_table).where(
+                    state.job_info_table.c.spot_job_id == job_id).values(
+                        schedule_state=schedule_state.value, pool=pool))
+            session.commit()
+        _insert_task(engine, job_id, 0, status=ManagedJobStatus.PENDING)
+
+    assert state.get_num_launching_jobs() == 1
+    assert state.get_num_alive_jobs() == 4
+    assert state.get_num_alive_jobs('pool-a') == 2
+    assert state.get_num_alive_jobs('pool-b') == 1
+    assert state.get_num_alive_jobs('pool-c') == 0
+    assert state.get_job_schedule_state(
+        job_id) == state.ManagedJobScheduleState.DONE
+    assert state.get_num_tasks(job_id) == 1
+
+
+def test_get_managed_job_tasks_reads_legacy_user_yaml(
+        _mock_managed_jobs_db_conn, tmp_path):
+    engine = _mock_managed_jobs_db_conn
+    yaml_path = tmp_path / 'user.yaml'
+    yaml_path.write_text('run: echo hi\n', encoding='utf-8')
+    job_ids = []
+    for content, path in [
+        ('run: echo stored\n', None),
+        (None, str(yaml_path)),
+        (None, str(tmp_path / 'missing.yaml')),
+    ]:
+        job_id = _insert_job_info(engine)
+        with orm.Session(engine) as session:
+            session.execute(
+                state.sqlalchemy.update(state.job_info_table).where(
+                    state.job_info_table.c.spot_job_id == job_id).values(
+                        original_user_yaml_content=content,
+                        original_user_yaml_path=path))
+            session.commit()
+        for task_id in range(2):
+            _insert_task(engine,
+                         job_id,
+                         task_id,
+                         status=ManagedJobStatus.PENDING)
+        job_ids.append(job_id)
+
+    expected = ['run: echo stored\n', 'run: echo hi\n', None]
+    for job_id, user_yaml in zip(job_ids, expected):
+        tasks = state.get_managed_job_tasks(job_id)
+        assert [task['user_yaml'] for task in tasks] == [user_yaml] * 2
+    jobs, total = state.get_managed_jobs_with_filters()
+    assert total == 6
+    assert {job['job_id']: job['user_yaml'] for job in jobs
+           } == dict(zip(job_ids, expected))
+
+
+def test_set_failed_override_terminal_prepends_reason(
+        _mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    _insert_task(engine, job_id, 0, status=ManagedJobStatus.SUCCEEDED, end_at=1)
+    _insert_task(engine, job_id, 1, status=ManagedJobStatus.RUNNING)
+    state.set_failed(job_id,
+                     task_id=1,
+                     failure_type=ManagedJobStatus.FAILED,
+                     failure_reason='first',
+                     end_time=2)
+    state.set_failed(job_id,
+                     task_id=None,
+                     failure_type=ManagedJobStatus.FAILED_CONTROLLER,
+                     failure_reason='second',
+                     end_time=3,
+                     override_terminal=True)
+    tasks = state.get_managed_job_tasks(job_id)
+    assert [task['failure_reason'] for task in tasks
+           ] == ['second', 'second. Previously: first']
+    assert [task['end_at'] for task in tasks] == [1, 2]
+    assert [task['status'] for task in tasks
+           ] == [ManagedJobStatus.FAILED_CONTROLLER] * 2
+
+
+def test_scheduler_set_done(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    other_job_id = _insert_job_info(engine)
+    state.scheduler_set_done(job_id)
+    assert (state.get_job_schedule_state(job_id) ==
+            state.ManagedJobScheduleState.DONE)
+    assert (state.get_job_schedule_state(other_job_id) ==
+            state.ManagedJobScheduleState.INACTIVE)
+    with pytest.raises(AssertionError):
+        state.scheduler_set_done(job_id)
+    state.scheduler_set_done(job_id, idempotent=True)
+
+
+def test_job_done_idempotent_skips_write_when_done(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    scheduler.job_done(job_id)
+    statements = []
+    state.sqlalchemy.event.listen(
+        engine, 'before_cursor_execute',
+        lambda _conn, _cursor, statement, *args: statements.append(statement))
+    for _ in range(3):
+        scheduler.job_done(job_id, idempotent=True)
+    # Only the schedule state is read, so the write lock is never taken.
+    assert not any(s.startswith('UPDATE') for s in statements), statements
+    assert (state.get_job_schedule_state(job_id) ==
+            state.ManagedJobScheduleState.DONE)
+
+
+def test_get_failure_reason_returns_first_reason(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    for task_id in range(3):
+        _insert_task(engine, job_id, task_id, status=ManagedJobStatus.RUNNING)
+    assert state.get_failure_reason(job_id) is None
+    for task_id in [2, 1]:
+        state.set_failed(job_id,
+                         task_id=task_id,
+                         failure_type=ManagedJobStatus.FAILED,
+                         failure_reason=f'task {task_id} failed')
+    assert state.get_failure_reason(job_id) == 'task 1 failed'
+
+
+def test_get_managed_job_tasks_projects_fields(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    _insert_task(engine, job_id, 0, status=ManagedJobStatus.RUNNING)
+    state.scheduler_set_waiting(job_id, 'dag', 'user', 'env', None, 100)
+    with orm.Session(engine) as session:
+        session.execute(
+            state.sqlalchemy.update(state.job_info_table).where(
+                state.job_info_table.c.spot_job_id == job_id).values(
+                    controller_pid=1234))
+        session.commit()
+
+    [task] = state.get_managed_job_tasks(
+        job_id, fields=['status', 'schedule_state', 'controller_pid'])
+    assert task['status'] == ManagedJobStatus.RUNNING
+    assert task['schedule_state'] == state.ManagedJobScheduleState.WAITING
+    assert task['controller_pid'] == 1234
+    assert task['dag_yaml_content'] is None
+    assert task['user_yaml'] is None
+    assert task['metadata'] is None
+
+    [task] = state.get_managed_job_tasks(job_id)
+    assert task['dag_yaml_content'] == 'dag'
+    assert task['user_yaml'] == 'user'
+
+
+def test_set_local_log_file_skips_unchanged_rows(_mock_managed_jobs_db_conn):
+    engine = _mock_managed_jobs_db_conn
+    job_id = _insert_job_info(engine)
+    _insert_task(engine, job_id, 0, status=ManagedJobStatus.RUNNING)
+    _insert_task(engine,
+                 job_id,
+                 1,
+                 status=ManagedJobStatus.RUNNING,
+                 local_log_file='/tmp/a.log')
+    updated_rows = []
+
+    @state.sqlalchemy.event.listens_for(engine, 'after_cursor_execute')
+    def _record_rowcount(conn, cursor, statement, parameters, context,
+                         executemany):
+        del conn, parameters, context, executemany  # Unused.
+        if statement.startswith('UPDATE spot'):
+            updated_rows.append(cursor.rowcount)
+
+    try:
+        state.set_local_log_file(job_id, None, '/tmp/a.log')
+        state.set_local_log_file(job_id, 1, '/tmp/a.log')
+        state.set_local_log_file(job_id, 1, '/tmp/b.log')
+    finally:
+        state.sqlalchemy.event.remove(engine, 'after_cursor_execute',
+                                      _record_rowcount)
+    assert updated_rows == [1, 0, 1]
+    tasks = state.get_managed_job_tasks(job_id, fields=['local_log_file'])
+    assert [task['local_log_file'] for task in tasks
+           ] == ['/tmp/a.log', '/tmp/b.log']
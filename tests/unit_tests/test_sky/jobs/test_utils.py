@@ -749,3 +749,20 @@ class TestControllerProcessAlive:
         monkeypatch.setattr(jobs_utils.psutil, 'Process', _NoKeywordProcess)
         assert (jobs_utils.controller_process_alive(record, legacy_job_id=42) is
                 False)
+
+
+class TestEventCallbackFunc:
+
+    @pytest.mark.asyncio
+    async def test_skips_thread_without_event_callback(self, monkeypatch):
+
+        async def _fail_to_thread(*args, **kwargs):
+            raise AssertionError('to_thread should not be called')
+
+        monkeypatch.setattr(jobs_utils.context_utils, 'to_thread',
+                            _fail_to_thread)
+        callback = jobs_utils.event_callback_func(job_id=1,
+                                                  task_id=0,
+                                                  task=None)
+        await callback('SUBMITTED')
+        await callback('STARTING')
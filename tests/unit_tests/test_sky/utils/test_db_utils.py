@@ -41,3 +41,15 @@ class TestSkyRuntimeDirEnvVar:
             db_path = call_args[0][0]
             expected_path = str(tmp_path / '.sky/test.db')
             assert expected_path in db_path
+
+
+def test_get_engine_caches_sqlite_engine(tmp_path, monkeypatch):
+    """Test repeated get_engine calls reuse the engine without a mkdir."""
+    monkeypatch.setenv('SKY_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.setattr(db_utils, '_sqlite_engine_cache', {})
+
+    engine = db_utils.get_engine(db_name='test')
+    assert (tmp_path / '.sky').is_dir()
+    with mock.patch('pathlib.Path.mkdir') as mock_mkdir:
+        assert db_utils.get_engine(db_name='test') is engine
+        mock_mkdir.assert_not_called()